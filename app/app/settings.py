@@ -55,6 +55,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'rest_framework.authtoken',
@@ -108,6 +109,24 @@ DATABASES = {
 }
 
 
+# Cache
+# Lokalno (dev) uporabljamo LocMemCache, v produkciji pa skupen cache (memcached),
+# ki ga nastavimo z environment spremenljivkami.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Cache za odgovore recipe API-ja (verzioniran po uporabniku)
+RECIPE_CACHE_ALIAS = 'default'
+RECIPE_CACHE_TIMEOUT = int(os.environ.get('RECIPE_CACHE_TIMEOUT', 3600))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -146,7 +165,8 @@ USE_TZ = True
 
 #STATIC_URL = '/static/'
 STATIC_URL = '/static/static/'
-MEDIA_URL = '/static/media/'
+#Media (slike receptov) ne streže nginx direktno - gre skozi RecipeMediaView (preverjanje lastnika)
+MEDIA_URL = '/media/'
 
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
@@ -165,4 +185,55 @@ REST_FRAMEWORK = {
 # To moramo omogočiti v primeru, da želimo, da upload slik deluje v brskalniku (schema generator - swagger)
 SPECTACULAR_SETTINGS = {
     "COMPONENT_SPLIT_REQUEST": True,
-}
\ No newline at end of file
+}
+
+# Autocomplete za tag-e in sestavine
+# Časovni proračun (ms) za poizvedbo - če ga presežemo, vrnemo prazen seznam
+AUTOCOMPLETE_TIMEOUT_MS = int(os.environ.get('AUTOCOMPLETE_TIMEOUT_MS', 100))
+# Minimalna podobnost (pg_trgm word_similarity) za "fuzzy" zadetke
+AUTOCOMPLETE_SIMILARITY_THRESHOLD = float(
+    os.environ.get('AUTOCOMPLETE_SIMILARITY_THRESHOLD', 0.5)
+)
+AUTOCOMPLETE_MAX_RESULTS = 50
+
+# Največje število receptov v enem bulk request-u (/api/recipe/recipes/bulk/)
+RECIPE_BULK_MAX_BATCH = int(os.environ.get('RECIPE_BULK_MAX_BATCH', 1000))
+
+# "Kaj lahko skuham" - največ manjkajočih sestavin in zadetkov
+PANTRY_MAX_MISSING = 5
+PANTRY_MAX_RESULTS = 1000
+
+# Podobni recepti (recipe/similarity.py)
+# Direktorij s shranjenimi indeksi (en .npz na uporabnika).
+#OPOMBA: Ne sme biti v /vol/web - ta volume proxy streže javno (/static)
+RECIPE_SIMILARITY_DIR = os.environ.get('RECIPE_SIMILARITY_DIR', '/vol/similarity')
+# Koliko spremenjenih receptov držimo v pomnilniku, preden indeks združimo in shranimo
+RECIPE_SIMILARITY_MAX_PENDING = 1000
+# Koliko bajtov indeksov (vseh uporabnikov skupaj) hrani en proces - vsak uwsgi worker svoje
+RECIPE_SIMILARITY_MAX_BYTES = int(os.environ.get('RECIPE_SIMILARITY_MAX_BYTES', 256 * 1024 * 1024))
+RECIPE_SIMILARITY_MAX_RESULTS = 100
+
+# Podvojeni recepti (recipe/dedup.py) - najmanjša ocenjena Jaccard podobnost
+# (naslov + sestavine), pri kateri sta recepta podvojena
+RECIPE_DUPLICATE_THRESHOLD = float(os.environ.get('RECIPE_DUPLICATE_THRESHOLD', 0.8))
+
+# Naključni recepti (/api/recipe/recipes/random/)
+RECIPE_RANDOM_MAX_COUNT = 50
+# Če filter (tag-i/sestavine) ustreza največ toliko receptom, jih kar premešamo (ORDER BY random())
+RECIPE_RANDOM_SCAN_LIMIT = 10000
+
+# Pomanjšane različice slik receptov (recipe/images.py): ime -> največja širina/višina v pikslih
+RECIPE_IMAGE_SIZES = {'thumb': 200, 'medium': 600, 'large': 1200}
+# Kako pogosto (sekunde) image worker (generate_image_derivatives --watch) preveri nove slike
+RECIPE_IMAGE_POLL_INTERVAL = float(os.environ.get('RECIPE_IMAGE_POLL_INTERVAL', 2))
+# Največja velikost naložene slike (enako kot client_max_body_size v proxy-ju) in število pikslov
+RECIPE_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+RECIPE_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+# Neuporabljene slike (collect_orphan_images) brišemo šele, ko so starejše od tega (sekunde)
+RECIPE_IMAGE_GC_GRACE = int(os.environ.get('RECIPE_IMAGE_GC_GRACE', 24 * 60 * 60))
+# RecipeMediaView (/media/...): po preverjanju lastnika prenos datoteke preda nginx-u
+# (X-Accel-Redirect na interno lokacijo v proxy/default.conf.tpl). Brez proxy-ja (DEBUG,
+# runserver) datoteko pošlje Django.
+MEDIA_ACCEL_REDIRECT_URL = None if DEBUG else '/protected-media/'
+# Koliko časa (sekunde) brskalnik hrani vsebinsko naslovljeno sliko (vsebina se ne spremeni)
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
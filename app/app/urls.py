@@ -19,9 +19,10 @@ from drf_spectacular.views import (
 )
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from recipe.views import RecipeMediaView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -41,14 +42,13 @@ urlpatterns = [
     path('api/recipe/', include('recipe.urls')),
 ]
 
-if settings.DEBUG:
-    #If we are running in debug mode (on local machine on development server)
-
-    # We are mimicking the behaviour that we expect when we're using our
-    # Django development server and we're essentially allowing it to serve
-    # media files
-    urlpatterns += static(
-        settings.MEDIA_URL,
-        document_root=settings.MEDIA_ROOT,
-    )
+#Media datoteke (slike receptov) streže RecipeMediaView - samo lastniku recepta.
+#V produkciji datoteko pošlje nginx (X-Accel-Redirect), v DEBUG načinu pa Django sam.
+urlpatterns += [
+    path(
+        f"{settings.MEDIA_URL.lstrip('/')}<path:name>",
+        RecipeMediaView.as_view(),
+        name='media',
+    ),
+]
 
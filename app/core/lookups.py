@@ -0,0 +1,39 @@
+"""
+Custom database lookups and functions.
+"""
+from django.db.models import CharField, FloatField, Func, IntegerField, Value
+from django.db.models.lookups import PostgresOperatorLookup
+
+
+#OPOMBA: Django 3.2 še nima "word similarity" (dodano v Django 4.0), zato ju dodamo sami.
+@CharField.register_lookup
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """`field %> value`: value is similar to some word inside field.
+
+    Served by a GIN index with the gin_trgm_ops operator class on field.
+    """
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+class TrigramWordSimilarity(Func):
+    """word_similarity(string, expression) as a float between 0 and 1."""
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        # Iskani niz je prvi argument (obratno kot pri TrigramSimilarity)
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
+
+
+class ArrayMissingCount(Func):
+    """Number of elements of the first integer array that are not in the second one.
+
+    Uses icount() and "-" from the intarray extension (migration 0014).
+    """
+    template = 'icount(%(expressions)s)'
+    arg_joiner = ' - '
+    arity = 2
+    output_field = IntegerField()
@@ -0,0 +1,318 @@
+"""
+Django command to benchmark recipe queries on generated data.
+"""
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import Count, Exists, IntegerField, OuterRef, Q, Value
+
+from core.lookups import ArrayMissingCount
+from core.models import Recipe, Tag, Ingredient
+from recipe import dedup, sampling
+from recipe.serializers import RecipeSerializer
+from recipe.similarity import SimilarityIndex
+from recipe.views import ORDERED_RELATIONS, RecipeViewSet
+
+
+BATCH_SIZE = 5000
+
+WORDS = [
+    "tomato", "lemon", "garlic", "chicken", "rice", "pasta", "basil",
+    "pepper", "onion", "carrot", "potato", "mushroom", "ginger", "salmon",
+    "spinach", "curry", "almond", "honey", "vanilla", "chocolate",
+]
+
+
+class Command(BaseCommand):
+    """Django command to benchmark recipe queries.
+
+    Data is generated inside a transaction that is always rolled back,
+    so the command can be run against a development database.
+    """
+
+    help = "Benchmark recipe queries on generated data (rolled back afterwards)."
+
+    cases = ["filters", "search", "serialize", "pantry", "similar", "duplicates", "random"]
+
+    def add_arguments(self, parser):
+        parser.add_argument("case", choices=self.cases)
+        parser.add_argument("--recipes", type=int, default=100000)
+        parser.add_argument("--tags", type=int, default=50)
+        parser.add_argument("--ingredients", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--explain", action="store_true", help="Print query plans."
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        self.options = options
+        with transaction.atomic():
+            self.stdout.write(f"Generating {options['recipes']} recipes...")
+            user = self.seed(options["recipes"])
+            getattr(self, f"bench_{options['case']}")(user)
+            # Generirani podatki se nikoli ne shranijo
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        """Create a user with `count` recipes, tags and ingredients."""
+        user = get_user_model().objects.create_user(
+            f"benchmark-{time.time_ns()}@example.com", "benchmark"
+        )
+        Tag.objects.bulk_create(
+            Tag(user=user, name=f"Tag {i}") for i in range(self.options["tags"])
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f"Ingredient {i}")
+            for i in range(self.options["ingredients"])
+        )
+
+        for start in range(0, count, BATCH_SIZE):
+            Recipe.objects.bulk_create(
+                Recipe(
+                    user=user,
+                    title=f"Recipe {i} {WORDS[i % len(WORDS)]}",
+                    description=f"Generated recipe with {WORDS[i * 7 % len(WORDS)]}",
+                    time_minutes=5 + i % 120,
+                    price=Decimal(i % 5000) / 100,
+                )
+                for i in range(start, min(start + BATCH_SIZE, count))
+            )
+
+        # Vsak recept dobi 3 tag-e in 8 sestavin (M2M vrstice naredimo kar v bazi)
+        self._link(Recipe.tags.through, Tag, user, 3)
+        self._link(Recipe.ingredients.through, Ingredient, user, 8)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return user
+
+    def _link(self, through, model, user, per_recipe):
+        """Attach `per_recipe` related objects to every recipe of the user."""
+        column = through._meta.get_field(model._meta.model_name).column
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {through._meta.db_table} (recipe_id, {column})
+                SELECT r.id, ids.arr[1 + (r.id + s * 7) %% cardinality(ids.arr)]
+                FROM {Recipe._meta.db_table} r,
+                     generate_series(0, %s - 1) s,
+                     (SELECT array_agg(id ORDER BY id) AS arr
+                      FROM {model._meta.db_table} WHERE user_id = %s) ids
+                WHERE r.user_id = %s
+                """,
+                [per_recipe, user.id, user.id],
+            )
+
+    def timed(self, func):
+        """Return the best of `repeat` runs of `func` in milliseconds."""
+        timings = []
+        for _ in range(self.options["repeat"]):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings)
+
+    def measure(self, label, queryset):
+        """Time the first page and the full result of `queryset`."""
+        page = self.timed(lambda: list(queryset[:100]))
+        full = self.timed(lambda: list(queryset.values_list("id", flat=True)))
+
+        self.stdout.write(f"{label}: first page {page:.2f} ms, all rows {full:.2f} ms")
+        if self.options["explain"]:
+            self.stdout.write(queryset.explain(analyze=True))
+
+    def bench_filters(self, user):
+        """JOIN + DISTINCT filtering against EXISTS / grouped HAVING."""
+        recipes = Recipe.objects.filter(user=user).order_by("-id")
+        # Tag-a 0 in 7 se pri generiranih podatkih pojavita skupaj na istih receptih
+        all_tag_ids = list(
+            Tag.objects.filter(user=user).order_by("id").values_list("id", flat=True)
+        )
+        tag_ids = [all_tag_ids[0], all_tag_ids[7]]
+        rows = Recipe.tags.through.objects.filter(tag_id__in=tag_ids)
+
+        self.measure(
+            "match=any JOIN + DISTINCT",
+            recipes.filter(tags__id__in=tag_ids).distinct(),
+        )
+        self.measure(
+            "match=any EXISTS",
+            recipes.filter(Exists(rows.filter(recipe_id=OuterRef("pk")))),
+        )
+        self.measure(
+            "match=all chained JOINs",
+            recipes.filter(tags__id=tag_ids[0]).filter(tags__id=tag_ids[1]).distinct(),
+        )
+        self.measure(
+            "match=all GROUP BY / HAVING",
+            recipes.filter(
+                id__in=rows.values("recipe_id").annotate(
+                    matched=Count("tag_id"),
+                ).filter(matched=len(tag_ids)).values("recipe_id")
+            ),
+        )
+
+    def bench_search(self, user):
+        """Full-text search through the GIN index against an ILIKE scan."""
+        recipes = Recipe.objects.filter(user=user)
+        # Naslov i-tega recepta ima WORDS[i % 20], opis pa WORDS[i * 7 % 20] - "lemon" (1)
+        # in "pepper" (7) sta skupaj v vsakem 20. receptu (i % 20 == 1), drugače nikoli
+        title_word, description_word = WORDS[1], WORDS[7]
+        scan = recipes.filter(
+            title__icontains=title_word, description__icontains=description_word,
+        ).order_by("-id")
+        # Ista poizvedba kot ?q= na seznamu receptov (rank in označen odlomek)
+        search = RecipeViewSet()._search(recipes, f"{title_word} {description_word}")
+
+        matches = scan.count()
+        if search.count() != matches:
+            raise CommandError(
+                f"Search found {search.count()} recipes, the ILIKE scan {matches}."
+            )
+        self.stdout.write(f"{matches} matching recipes")
+        self.measure("title/description icontains", scan)
+        self.measure("search_vector @@ query, ranked, with headline", search)
+
+    def bench_serialize(self, user):
+        """RecipeSerializer on model instances against the values() fast path."""
+        recipes = Recipe.objects.filter(user=user).order_by("-id")
+        columns = [
+            name for name in RecipeSerializer.Meta.fields
+            if name not in RecipeSerializer.expandable_fields
+        ]
+
+        instances = list(recipes.prefetch_related(*ORDERED_RELATIONS))
+        rows = list(recipes.values(*columns))
+        model = self.timed(lambda: RecipeSerializer(instances, many=True).data)
+        # Hitra pot sama naloži tag-e in sestavine, zato je v času tudi ta poizvedba
+        fast = self.timed(lambda: RecipeSerializer(rows, many=True).data)
+        self.stdout.write(
+            f"serialize {len(rows)} recipes: model instances {model:.2f} ms, "
+            f"values() fast path {fast:.2f} ms ({model / fast:.1f}x)"
+        )
+
+        model = self.timed(
+            lambda: RecipeSerializer(
+                list(recipes.prefetch_related(*ORDERED_RELATIONS)), many=True,
+            ).data
+        )
+        fast = self.timed(
+            lambda: RecipeSerializer(list(recipes.values(*columns)), many=True).data
+        )
+        self.stdout.write(
+            f"fetch + serialize: model instances {model:.2f} ms, "
+            f"values() fast path {fast:.2f} ms ({model / fast:.1f}x)"
+        )
+
+    def bench_pantry(self, user):
+        """Pantry matching: M2M join/grouping against the ingredient_ids GIN index."""
+        recipes = Recipe.objects.filter(user=user)
+        # Generirani recepti s sestavinami samo iz prvih 60 jih pokrije ~5 %
+        pantry_ids = list(
+            Ingredient.objects.filter(user=user).order_by("id")
+            .values_list("id", flat=True)[:60]
+        )
+        pantry = Value(pantry_ids, output_field=ArrayField(IntegerField()))
+        rows = Recipe.ingredients.through.objects.filter(recipe__user=user)
+
+        self.measure(
+            "ingredients__id__in JOIN + DISTINCT (any ingredient - wrong result)",
+            recipes.filter(ingredients__id__in=pantry_ids).distinct().order_by("-id"),
+        )
+        for max_missing in (0, 2):
+            self.measure(
+                f"missing <= {max_missing}: M2M GROUP BY / HAVING",
+                recipes.filter(
+                    id__in=rows.values("recipe_id").annotate(
+                        missing=Count("pk") - Count("pk", filter=Q(ingredient_id__in=pantry_ids)),
+                    ).filter(missing__lte=max_missing).values("recipe_id")
+                ).order_by("-id"),
+            )
+
+        self.measure(
+            "missing <= 0: ingredient_ids <@ pantry",
+            recipes.filter(ingredient_ids__contained_by=pantry)
+            .exclude(ingredient_ids=[]).order_by("-id"),
+        )
+        for max_missing in (0, 2):
+            self.measure(
+                f"missing <= {max_missing}: ingredient_ids && pantry + icount, ranked",
+                recipes.filter(ingredient_ids__overlap=pantry)
+                .annotate(missing=ArrayMissingCount("ingredient_ids", pantry))
+                .filter(missing__lte=max_missing).order_by("missing", "-id"),
+            )
+
+    def bench_similar(self, user):
+        """Similar recipes: SQL self-join on the M2M table against the NumPy index."""
+        recipe_ids = list(
+            Recipe.objects.filter(user=user).order_by("id").values_list("id", flat=True)
+        )
+        samples = recipe_ids[::len(recipe_ids) // 20 or 1][:20]
+
+        start = time.perf_counter()
+        index = SimilarityIndex.build(user.id)
+        self.stdout.write(f"build index: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        with connection.cursor() as cursor:
+            def self_join():
+                # Presek sestavin z vsemi recepti (tag-i bi pomenili še en join)
+                for recipe_id in samples:
+                    cursor.execute(
+                        """
+                        SELECT b.recipe_id, count(*) AS shared
+                        FROM core_recipe_ingredients a
+                        JOIN core_recipe_ingredients b ON b.ingredient_id = a.ingredient_id
+                        WHERE a.recipe_id = %s AND b.recipe_id <> %s
+                        GROUP BY b.recipe_id ORDER BY shared DESC, b.recipe_id DESC LIMIT 10
+                        """,
+                        [recipe_id, recipe_id],
+                    )
+                    cursor.fetchall()
+
+            sql = self.timed(self_join) / len(samples)
+
+        indexed = self.timed(
+            lambda: [index.similar(recipe_id, 10) for recipe_id in samples]
+        ) / len(samples)
+        self.stdout.write(
+            f"top 10 similar: SQL self-join (ingredients only) {sql:.2f} ms, "
+            f"NumPy index (tags + ingredients) {indexed:.2f} ms per recipe"
+        )
+
+    def bench_duplicates(self, user):
+        """MinHash signatures and LSH clustering (linear in the number of recipes)."""
+        count = Recipe.objects.filter(user=user).count()
+        start = time.perf_counter()
+        dedup.update_signatures(user.id)
+        hashed = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        clusters = dedup.clusters(user.id)
+        clustered = (time.perf_counter() - start) * 1000
+        self.stdout.write(
+            f"{count} recipes: signatures {hashed:.2f} ms, LSH clusters {clustered:.2f} ms "
+            f"({len(clusters)} groups, {sum(map(len, clusters))} recipes); "
+            f"all pairs would be {count * (count - 1) // 2} comparisons"
+        )
+
+    def bench_random(self, user):
+        """Random recipes: ORDER BY random() against random_key index probes."""
+        recipes = Recipe.objects.filter(user=user).values("id", "title")
+        tag_id = Tag.objects.filter(user=user).order_by("id").values_list("id", flat=True)[0]
+        tagged = recipes.filter(
+            Exists(Recipe.tags.through.objects.filter(recipe_id=OuterRef("pk"), tag_id=tag_id))
+        )
+
+        for label, queryset in (("all recipes", recipes), ("one tag", tagged)):
+            for count in (1, 10):
+                scan = self.timed(lambda: list(queryset.order_by("?")[:count]))
+                probe = self.timed(lambda: sampling.sample(queryset, count))
+                self.stdout.write(
+                    f"{label}, {count} random: ORDER BY random() {scan:.2f} ms, "
+                    f"random_key probes {probe:.2f} ms"
+                )
@@ -0,0 +1,34 @@
+"""
+Django command to build the similar-recipe indexes.
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipe.similarity import SimilarityIndex
+
+
+class Command(BaseCommand):
+    """Django command to rebuild and save the similarity index of users.
+
+    Indexes are also built on first use and updated incrementally, so this
+    is only needed to prebuild them (e.g. after a deploy) or to compact them.
+    """
+
+    help = "Rebuild the similar-recipe index (.npz) of every user with recipes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="users",
+            help="Only rebuild the index of this user id (can be repeated).",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        users = get_user_model().objects.filter(recipe__isnull=False).distinct()
+        if options["users"]:
+            users = users.filter(id__in=options["users"])
+
+        for user_id in users.order_by("id").values_list("id", flat=True):
+            index = SimilarityIndex.build(user_id)
+            index.save()
+            self.stdout.write(f"user {user_id}: {len(index.segment.recipe_ids)} recipes")
@@ -0,0 +1,40 @@
+"""
+Django command to delete recipe image files no recipe references.
+"""
+from django.core.management.base import BaseCommand
+
+from recipe import orphans
+
+
+class Command(BaseCommand):
+    """Django command to garbage collect replaced and deleted recipe images.
+
+    The upload directory is walked incrementally and compared with a Bloom
+    filter of the referenced images, so memory stays bounded with millions
+    of files. Files younger than RECIPE_IMAGE_GC_GRACE are kept.
+    """
+
+    help = "Delete recipe images and derivatives that no recipe references anymore."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only list the orphaned files, do not delete them.",
+        )
+        parser.add_argument(
+            "--limit", type=int,
+            help="Stop after this many files (run again to continue).",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        dry_run = options["dry_run"]
+        count = size = 0
+        for name, file_size in orphans.collect(dry_run=dry_run, limit=options["limit"]):
+            count += 1
+            size += file_size
+            if dry_run or options["verbosity"] > 1:
+                self.stdout.write(name)
+
+        action = "would delete" if dry_run else "deleted"
+        self.stdout.write(f"{action} {count} files ({size} bytes)")
@@ -0,0 +1,52 @@
+"""
+Django command to report near-duplicate recipes.
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe, RecipeDuplicates
+from recipe import dedup
+
+
+class Command(BaseCommand):
+    """Django command to list groups of near-duplicate recipes per user.
+
+    Missing MinHash signatures (new or changed recipes) are computed first,
+    then recipes sharing an LSH bucket are verified and grouped. The groups
+    are also stored for the duplicates endpoint.
+    """
+
+    help = "Report groups of recipes with (nearly) the same title and ingredients."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="users",
+            help="Only check recipes of this user id (can be repeated).",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        hashed = dedup.update_signatures()
+        self.stdout.write(f"hashed {hashed} recipes")
+
+        users = get_user_model().objects.filter(recipe__isnull=False).distinct()
+        if options["users"]:
+            users = users.filter(id__in=options["users"])
+
+        for user_id in users.order_by("id").values_list("id", flat=True):
+            clusters = dedup.clusters(user_id)
+            RecipeDuplicates.objects.update_or_create(
+                user_id=user_id, defaults={"clusters": clusters},
+            )
+            if not clusters:
+                continue
+            titles = dict(
+                Recipe.objects.filter(
+                    id__in=[i for cluster in clusters for i in cluster],
+                ).values_list("id", "title")
+            )
+            self.stdout.write(f"user {user_id}: {len(clusters)} groups")
+            for cluster in clusters:
+                self.stdout.write(
+                    "  " + ", ".join(f"#{i} {titles[i]}" for i in cluster if i in titles)
+                )
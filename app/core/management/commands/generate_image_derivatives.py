@@ -0,0 +1,99 @@
+"""
+Django command to generate resized derivatives of recipe images.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.models import Recipe
+from recipe import images
+
+
+def generate(image_name):
+    """Generate derivatives in a worker process (the exception if the image is broken)."""
+    try:
+        return images.generate(image_name)
+    except Exception as exc:
+        return exc
+
+
+class Command(BaseCommand):
+    """Django command to generate Recipe.image_derivatives.
+
+    Decoding and resizing is CPU bound, so images are processed in a pool of
+    processes; the results are stored by this (parent) process. With --watch
+    the command is the image worker: it keeps generating derivatives of new
+    uploads (uwsgi workers never decode images).
+    """
+
+    help = "Generate missing thumbnails/derivatives of recipe images with a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(),
+            help="Number of worker processes (default: number of CPUs).",
+        )
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Regenerate derivatives of every image, not only missing ones.",
+        )
+        parser.add_argument(
+            "--watch", action="store_true",
+            help="Keep running and generate derivatives of new images (the image worker).",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if not options["watch"]:
+            recipes = images.pending()
+            if options["all"]:
+                recipes = Recipe.objects.filter(image__gt="")
+            rows = list(recipes.order_by("id").values_list("id", "user_id", "image"))
+            generated, failed = self.process(rows, options["workers"], reuse=not options["all"])
+            self.stdout.write(f"generated {generated}, failed {len(failed)}")
+            return
+
+        # Pokvarjenih slik ne poskušamo znova (do ponovnega zagona worker-ja)
+        skipped = set()
+        while True:
+            rows = [
+                row for row in images.pending().order_by("id").values_list("id", "user_id", "image")
+                if row not in skipped
+            ]
+            if rows:
+                generated, failed = self.process(rows, options["workers"])
+                skipped.update(failed)
+                self.stdout.write(f"generated {generated}, failed {len(failed)}")
+            time.sleep(settings.RECIPE_IMAGE_POLL_INTERVAL)
+
+    def process(self, rows, workers, reuse=True):
+        """Generate and store derivatives of (recipe id, user id, image) rows.
+
+        Returns the number of recipes updated and the rows that failed.
+        """
+        generated, failed, todo = 0, [], []
+        for row in rows:
+            derivatives = images.existing_derivatives(row[1], row[2]) if reuse else None
+            if derivatives:
+                generated += images.save(*row, derivatives)
+            else:
+                todo.append(row)
+        if not todo:
+            return generated, failed
+
+        # Procesi podedujejo odprto povezavo na bazo (fork) - pred tem jo zapremo.
+        # Pool traja en prehod: pomnilnik dekodiranih slik se sprosti z izhodom procesov
+        connection.close()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(generate, [row[2] for row in todo], chunksize=8)
+            for row, result in zip(todo, results):
+                if isinstance(result, Exception):
+                    failed.append(row)
+                    self.stderr.write(f"recipe {row[0]}: {row[2]}: {result}")
+                elif images.save(*row, result):
+                    generated += 1
+        return generated, failed
@@ -0,0 +1,22 @@
+"""
+Django command to report recipe response cache hit/miss counters.
+"""
+from django.core.management.base import BaseCommand
+
+from recipe import cache
+
+
+class Command(BaseCommand):
+    """Django command to report cache statistics."""
+
+    help = "Report hit/miss counters of the recipe response cache."
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        stats = cache.get_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total if total else 0
+
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} hit_ratio={ratio:.2%}"
+        )
@@ -0,0 +1,42 @@
+"""
+Django command to recount how many recipes use each tag and ingredient.
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.models import Recipe, Tag, Ingredient
+
+
+class Command(BaseCommand):
+    """Django command to reconcile Tag/Ingredient.recipe_count.
+
+    The counters are maintained by triggers in the database (migration 0012),
+    so this is only needed after manual SQL changes or for verification.
+    """
+
+    help = "Recount recipe_count of tags and ingredients and fix mismatches."
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        for model, field in ((Tag, "tags"), (Ingredient, "ingredients")):
+            through = getattr(Recipe, field).through
+            column = model._meta.model_name
+            actual = Coalesce(
+                Subquery(
+                    through.objects.filter(**{column: OuterRef("pk")})
+                    .values(column).annotate(n=Count("pk")).values("n")
+                ),
+                0,
+            )
+
+            with transaction.atomic():
+                # Med štetjem ne sme nihče spreminjati povezav (sicer bi zapisali zastarel števec)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LOCK TABLE {through._meta.db_table} IN SHARE MODE")
+                fixed = model.objects.annotate(actual=actual).exclude(
+                    recipe_count=F("actual"),
+                ).update(recipe_count=actual)
+
+            self.stdout.write(f"{model._meta.verbose_name_plural}: fixed {fixed}")
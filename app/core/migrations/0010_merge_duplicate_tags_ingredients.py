@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:58
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge tags/ingredients with the same (user, name) into the oldest one.
+
+    Recipes linked to a duplicate are linked to the kept row instead, then the
+    duplicates (and their M2M rows) are deleted.
+    """
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, field in (('Tag', 'tags'), ('Ingredient', 'ingredients')):
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field).through
+        column = f'{model_name.lower()}_id'
+
+        groups = model.objects.values('user_id', 'name').annotate(
+            keep=Min('id'), count=Count('id'),
+        ).filter(count__gt=1)
+        for group in groups:
+            duplicates = list(
+                model.objects.filter(user_id=group['user_id'], name=group['name'])
+                .exclude(id=group['keep']).values_list('id', flat=True)
+            )
+            recipe_ids = through.objects.filter(
+                **{f'{column}__in': duplicates}
+            ).values_list('recipe_id', flat=True).distinct()
+            through.objects.bulk_create(
+                [through(recipe_id=recipe_id, **{column: group['keep']}) for recipe_id in recipe_ids],
+                ignore_conflicts=True,
+            )
+            model.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipe_updated_at'),
+    ]
+
+    # Unikatne omejitve dodamo v naslednji migraciji - PostgreSQL ne dovoli
+    # ALTER TABLE v isti transakciji kot brisanje vrstic z odloženimi FK preverjanji
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:02
+
+from django.db import migrations, models
+
+
+# Statement-level triggers on the M2M tables keep Tag/Ingredient.recipe_count
+# in sync in the same transaction - also for bulk inserts (bulk endpoint) and
+# cascade deletes, which do not send m2m_changed. Each statement updates every
+# affected tag/ingredient once, with the number of inserted/deleted rows.
+# Recount with: python manage.py reconcile_recipe_counts
+CREATE_FUNCTION = """
+CREATE FUNCTION core_recipe_count_update() RETURNS trigger AS $$
+DECLARE
+    -- TG_ARGV[0] = tabela s števcem, TG_ARGV[1] = stolpec v M2M tabeli
+    rows_table text := CASE WHEN TG_OP = 'INSERT' THEN 'new_rows' ELSE 'old_rows' END;
+    sign text := CASE WHEN TG_OP = 'INSERT' THEN '+' ELSE '-' END;
+BEGIN
+    EXECUTE format(
+        'UPDATE %I t SET recipe_count = t.recipe_count %s d.n '
+        'FROM (SELECT %I AS id, count(*) AS n FROM %I GROUP BY 1) d '
+        'WHERE t.id = d.id',
+        TG_ARGV[0], sign, TG_ARGV[1], rows_table
+    );
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGERS = """
+CREATE TRIGGER {table}_count_insert
+    AFTER INSERT ON {through} REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_count_update('{table}', '{column}');
+CREATE TRIGGER {table}_count_delete
+    AFTER DELETE ON {through} REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_count_update('{table}', '{column}');
+
+UPDATE {table} t SET recipe_count = (
+    SELECT count(*) FROM {through} r WHERE r.{column} = t.id
+);
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER {table}_count_insert ON {through};
+DROP TRIGGER {table}_count_delete ON {through};
+"""
+
+TABLES = [
+    {"table": "core_tag", "through": "core_recipe_tags", "column": "tag_id"},
+    {"table": "core_ingredient", "through": "core_recipe_ingredients", "column": "ingredient_id"},
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_tag_ingredient_user_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(CREATE_FUNCTION, "DROP FUNCTION core_recipe_count_update();"),
+        *[
+            migrations.RunSQL(CREATE_TRIGGERS.format(**names), DROP_TRIGGERS.format(**names))
+            for names in TABLES
+        ],
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(('recipe_count__gt', 0)), fields=['user', 'name'], name='core_ingredient_assigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', '-recipe_count', '-id'], name='core_ingredient_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(condition=models.Q(('recipe_count__gt', 0)), fields=['user', 'name'], name='core_tag_assigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', '-recipe_count', '-id'], name='core_tag_popular_idx'),
+        ),
+    ]
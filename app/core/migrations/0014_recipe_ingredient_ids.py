@@ -0,0 +1,87 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:06
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import CreateExtension
+from django.db import migrations, models
+
+
+# Statement-level triggers on the recipe/ingredient M2M table keep
+# Recipe.ingredient_ids in sync (like recipe_count in migration 0012).
+# intarray provides "-" (remove elements), icount() and the gin__int_ops index.
+# intarray only supports int4 arrays, so the (bigint) ingredient ids are cast.
+CREATE_TRIGGERS = """
+CREATE FUNCTION core_recipe_ingredient_ids_add() RETURNS trigger AS $$
+BEGIN
+    UPDATE core_recipe r SET ingredient_ids = r.ingredient_ids || d.ids
+    FROM (
+        SELECT recipe_id, array_agg(ingredient_id::int) AS ids FROM new_rows GROUP BY 1
+    ) d
+    WHERE r.id = d.recipe_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION core_recipe_ingredient_ids_remove() RETURNS trigger AS $$
+BEGIN
+    UPDATE core_recipe r SET ingredient_ids = r.ingredient_ids - d.ids
+    FROM (
+        SELECT recipe_id, array_agg(ingredient_id::int) AS ids FROM old_rows GROUP BY 1
+    ) d
+    WHERE r.id = d.recipe_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_recipe_ingredient_ids_insert
+    AFTER INSERT ON core_recipe_ingredients REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_ingredient_ids_add();
+CREATE TRIGGER core_recipe_ingredient_ids_delete
+    AFTER DELETE ON core_recipe_ingredients REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_ingredient_ids_remove();
+
+UPDATE core_recipe r SET ingredient_ids = ARRAY(
+    SELECT ingredient_id::int FROM core_recipe_ingredients WHERE recipe_id = r.id
+);
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER core_recipe_ingredient_ids_insert ON core_recipe_ingredients;
+DROP TRIGGER core_recipe_ingredient_ids_delete ON core_recipe_ingredients;
+DROP FUNCTION core_recipe_ingredient_ids_add();
+DROP FUNCTION core_recipe_ingredient_ids_remove();
+"""
+
+# search_vector se izračuna samo, ko se spremenita title ali description - sicer
+# bi ga vsak UPDATE zgornjih triggerjev po nepotrebnem računal znova
+SEARCH_TRIGGER = """
+DROP TRIGGER core_recipe_search_vector_trigger ON core_recipe;
+CREATE TRIGGER core_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF {columns} ON core_recipe
+    FOR EACH ROW EXECUTE FUNCTION core_recipe_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_recipe_range_indexes'),
+    ]
+
+    operations = [
+        CreateExtension('intarray'),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, editable=False, size=None),
+        ),
+        migrations.RunSQL(
+            SEARCH_TRIGGER.format(columns="title, description"),
+            SEARCH_TRIGGER.replace(" OF {columns}", ""),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='core_recipe_ingredient_ids_idx', opclasses=['gin__int_ops']),
+        ),
+    ]
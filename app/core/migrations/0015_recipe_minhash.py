@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:17
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+# The signature is computed in Python (recipe/dedup.py), so the trigger only
+# clears it when the title or the ingredients (ingredient_ids, migration 0014)
+# change. Recipes with minhash IS NULL are hashed again on the next pass.
+CREATE_TRIGGER = """
+CREATE FUNCTION core_recipe_minhash_invalidate() RETURNS trigger AS $$
+BEGIN
+    IF NEW.title IS DISTINCT FROM OLD.title
+            OR NEW.ingredient_ids IS DISTINCT FROM OLD.ingredient_ids THEN
+        NEW.minhash := NULL;
+        NEW.lsh_bands := NULL;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_recipe_minhash_trigger
+    BEFORE UPDATE OF title, ingredient_ids ON core_recipe
+    FOR EACH ROW EXECUTE FUNCTION core_recipe_minhash_invalidate();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER core_recipe_minhash_trigger ON core_recipe;
+DROP FUNCTION core_recipe_minhash_invalidate();
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_ingredient_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='lsh_bands',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), editable=False, null=True, size=None),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='minhash',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), editable=False, null=True, size=None),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['lsh_bands'], name='core_recipe_lsh_bands_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('minhash__isnull', True)), fields=['user', 'id'], name='core_recipe_unhashed_idx'),
+        ),
+    ]
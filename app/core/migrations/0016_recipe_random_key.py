@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:23
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_recipe_minhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='random_key',
+            field=models.FloatField(default=core.models.recipe_random_key, editable=False),
+        ),
+        # AddField vsem obstoječim receptom nastavi isto (enkrat izračunano) vrednost
+        migrations.RunSQL(
+            "UPDATE core_recipe SET random_key = random();",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'random_key'], name='core_recipe_user_random_idx'),
+        ),
+    ]
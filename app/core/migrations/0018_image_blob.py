@@ -0,0 +1,84 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:50
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+# Row-level triggers on core_recipe count the recipes per image file in
+# core_imageblob (content-addressed files are shared between recipes). When
+# the last recipe lets go of a file, released_at records when; such files
+# can be deleted after a grace period.
+CREATE_FUNCTION = """
+CREATE FUNCTION core_image_blob_refcount() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' AND coalesce(OLD.image, '') <> '' THEN
+        UPDATE core_imageblob
+        SET refcount = refcount - 1,
+            released_at = CASE WHEN refcount = 1 THEN now() END
+        WHERE name = OLD.image;
+    END IF;
+    IF TG_OP <> 'DELETE' AND coalesce(NEW.image, '') <> '' THEN
+        INSERT INTO core_imageblob (name, refcount) VALUES (NEW.image, 1)
+        ON CONFLICT (name) DO UPDATE
+        SET refcount = core_imageblob.refcount + 1, released_at = NULL;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGERS = """
+CREATE TRIGGER core_recipe_image_insert
+    AFTER INSERT ON core_recipe
+    FOR EACH ROW EXECUTE FUNCTION core_image_blob_refcount();
+CREATE TRIGGER core_recipe_image_update
+    AFTER UPDATE OF image ON core_recipe
+    FOR EACH ROW WHEN (OLD.image IS DISTINCT FROM NEW.image)
+    EXECUTE FUNCTION core_image_blob_refcount();
+CREATE TRIGGER core_recipe_image_delete
+    AFTER DELETE ON core_recipe
+    FOR EACH ROW EXECUTE FUNCTION core_image_blob_refcount();
+
+INSERT INTO core_imageblob (name, refcount)
+SELECT image, count(*) FROM core_recipe WHERE image <> '' GROUP BY image;
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER core_recipe_image_insert ON core_recipe;
+DROP TRIGGER core_recipe_image_update ON core_recipe;
+DROP TRIGGER core_recipe_image_delete ON core_recipe;
+DROP FUNCTION core_image_blob_refcount();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_recipe_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('released_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.models.recipe_image_file_path),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'image'], name='core_recipe_user_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imageblob',
+            index=models.Index(condition=models.Q(('refcount', 0)), fields=['released_at'], name='core_imageblob_released_idx'),
+        ),
+        migrations.RunSQL(CREATE_FUNCTION + CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
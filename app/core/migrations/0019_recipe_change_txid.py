@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+# The similarity index (recipe/similarity.py) finds changed recipes by the id
+# of the transaction that last changed them, not by updated_at: a transaction
+# can commit long after its updated_at. txid_current() is 64-bit (with the
+# epoch), so it never wraps around. Only changes that matter for the index
+# (updated_at is touched on every save and tag/ingredient change) set it.
+CREATE_TRIGGER = """
+CREATE FUNCTION core_recipe_change_txid_update() RETURNS trigger AS $$
+BEGIN
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_recipe_change_txid_trigger
+    BEFORE INSERT OR UPDATE OF updated_at, ingredient_ids ON core_recipe
+    FOR EACH ROW EXECUTE FUNCTION core_recipe_change_txid_update();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER core_recipe_change_txid_trigger ON core_recipe;
+DROP FUNCTION core_recipe_change_txid_update();
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_image_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='change_txid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'change_txid'], name='core_recipe_user_txid_idx'),
+        ),
+    ]
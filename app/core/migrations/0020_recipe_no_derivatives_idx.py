@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_recipe_change_txid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('image__gt', ''), ('image_derivatives', {})), fields=['id'], name='core_recipe_no_derivatives_idx'),
+        ),
+    ]
@@ -5,8 +5,12 @@ Database models.
 
 import uuid # will be used to generate UID
 import os # we need for file path management
+import random
 
 from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth.models import (
     AbstractBaseUser,
@@ -14,6 +18,8 @@ from django.contrib.auth.models import (
     PermissionsMixin,
 )
 
+from core.storage import ContentAddressedStorage
+
 
 # Funkcija, ki se bo uporabljala za generiranje poti do slike, ki jo upload-amo
 # So this is the function that is going to be used to generate the path to the image that we upload.
@@ -34,6 +40,13 @@ def recipe_image_file_path(instance, filename):
     return os.path.join("uploads", "recipe", filename)
 
 
+# Naključni ključ recepta (enakomerno med 0 in 1)
+# OPOMBA: Mora biti funkcija v modulu (in ne random.random), da jo lahko zapišemo v migracijo
+def recipe_random_key():
+    """Generate random key for new recipe."""
+    return random.random()
+
+
 # Create your models here.
 
 class UserManager(BaseUserManager):
@@ -70,7 +83,27 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     USERNAME_FIELD = 'email'
 
-class Recipe(models.Model):
+class DatabaseMaintainedFieldsMixin:
+    """Never write `db_maintained_fields` from Python - triggers in the database maintain them."""
+
+    db_maintained_fields = ()
+
+    def save(self, *args, **kwargs):
+        #OPOMBA: Brez tega bi save() (npr. preimenovanje) prepisal vrednost, ki jo je
+        #medtem spremenil trigger, z zastarelo vrednostjo iz Pythona
+        if not self._state.adding and kwargs.get("update_fields") is None \
+                and not kwargs.get("force_insert"):
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.db_maintained_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class Recipe(DatabaseMaintainedFieldsMixin, models.Model):
     """Recipe objects."""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, #relacija na User model --> ker uporabljamo custom User model naredimo referenco rajši preko settingsov (tam smo definirali kateru User model uporabljamo)
@@ -86,13 +119,86 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True) #web link do spletne strani recepta
     tags = models.ManyToManyField("Tag")
     ingredients = models.ManyToManyField("Ingredient")
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path) # referenca na funkcijo (nismo poklicali/zagnali funkcijo)
+    #Datoteka dobi ime po SHA-256 vsebine (ContentAddressedStorage) - enaka slika je shranjena enkrat
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path, # referenca na funkcijo (nismo poklicali/zagnali funkcijo)
+        storage=ContentAddressedStorage(),
+    )
+    #Pomanjšane različice slike (thumb, medium, large v WebP in JPEG) - naredi jih recipe/images.py
+    image_derivatives = models.JSONField(default=dict, editable=False)
+
+    #Polje za full-text search (title + description).
+    #OPOMBA: Vrednost nastavlja trigger v bazi (migracija 0007) - ne nastavljaj je ročno.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    #Čas zadnje spremembe (tudi tag-ov/sestavin recepta) - iz njega izračunamo ETag
+    updated_at = models.DateTimeField(auto_now=True)
+
+    #ID-ji sestavin recepta (kopija M2M relacije) za iskanje "kaj lahko skuham".
+    #OPOMBA: Vrednost nastavlja trigger v bazi (migracija 0014) - ne nastavljaj je ročno.
+    ingredient_ids = ArrayField(models.IntegerField(), default=list, editable=False)
+
+    #MinHash podpis (naslov + sestavine) in LSH bucket-i za iskanje podvojenih receptov.
+    #OPOMBA: Izračuna jih recipe/dedup.py, trigger v bazi (migracija 0015) pa ju
+    #pobriše (NULL), ko se spremenita naslov ali sestavine - ne nastavljaj ju ročno.
+    minhash = ArrayField(models.IntegerField(), null=True, editable=False)
+    lsh_bands = ArrayField(models.BigIntegerField(), null=True, editable=False)
+
+    #ID transakcije zadnje spremembe (txid_current()) - po njem indeks podobnih receptov
+    #(recipe/similarity.py) najde spremembe neodvisno od ure.
+    #OPOMBA: Vrednost nastavlja trigger v bazi (migracija 0019) - ne nastavljaj je ročno.
+    change_txid = models.BigIntegerField(default=0, editable=False)
+
+    #Naključni ključ za izbiro naključnih receptov (recipe/sampling.py) - nastavi se ob kreiranju
+    random_key = models.FloatField(default=recipe_random_key, editable=False)
+
+    db_maintained_fields = (
+        "search_vector", "ingredient_ids", "minhash", "lsh_bands", "change_txid",
+    )
+
+    class Meta:
+        indexes = [
+            # Supports keyset pagination: WHERE user_id = ? AND id < ? ORDER BY id DESC
+            models.Index(fields=["user", "id"], name="core_recipe_user_id_idx"),
+            # Max(updated_at) per user for list ETags
+            models.Index(fields=["user", "updated_at"], name="core_recipe_user_updated_idx"),
+            GinIndex(fields=["search_vector"], name="core_recipe_search_idx"),
+            # Filtri in sortiranje (?ordering=) z keyset paginacijo
+            models.Index(fields=["user", "price", "id"], name="core_recipe_user_price_idx"),
+            models.Index(fields=["user", "time_minutes", "id"], name="core_recipe_user_time_idx"),
+            models.Index(fields=["user", "title", "id"], name="core_recipe_user_title_idx"),
+            # ingredient_ids <@ / && shramba (operatorji iz razširitve intarray)
+            GinIndex(
+                fields=["ingredient_ids"], name="core_recipe_ingredient_ids_idx",
+                opclasses=["gin__int_ops"],
+            ),
+            # Naključni recepti: WHERE user_id = ? AND random_key >= ? ORDER BY random_key LIMIT 1
+            models.Index(fields=["user", "random_key"], name="core_recipe_user_random_idx"),
+            # Recepti z istim LSH bucket-om (lsh_bands && ...)
+            GinIndex(fields=["lsh_bands"], name="core_recipe_lsh_bands_idx"),
+            # Recepti brez podpisa (novi ali spremenjeni)
+            models.Index(
+                fields=["user", "id"], condition=models.Q(minhash__isnull=True),
+                name="core_recipe_unhashed_idx",
+            ),
+            # Spremembe od transakcije naprej (indeks podobnih receptov)
+            models.Index(fields=["user", "change_txid"], name="core_recipe_user_txid_idx"),
+            # Slike brez pomanjšanih različic (image worker, recipe/images.py)
+            models.Index(
+                fields=["id"], condition=models.Q(image__gt="", image_derivatives={}),
+                name="core_recipe_no_derivatives_idx",
+            ),
+            # Recepti uporabnika z isto sliko (deljene pomanjšane različice)
+            models.Index(fields=["user", "image"], name="core_recipe_user_image_idx"),
+        ]
+
     #String representation of the object
     #To vpliva tudi kako se prikazuje v Django-Admin (na spletni strani)
     def __str__(self):
         return self.title
 
-class Tag(models.Model):
+class Tag(DatabaseMaintainedFieldsMixin, models.Model):
     """Tag for filtering recipes."""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
@@ -100,11 +206,34 @@ class Tag(models.Model):
         on_delete = models.CASCADE,
     )
 
+    #Število receptov s tem tag-om.
+    #OPOMBA: Vrednost nastavlja trigger v bazi (migracija 0012) - ne nastavljaj je ročno.
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    db_maintained_fields = ("recipe_count",)
+
+    class Meta:
+        indexes = [
+            # Trigram index za autocomplete (pg_trgm)
+            GinIndex(fields=["name"], name="core_tag_name_trgm_idx", opclasses=["gin_trgm_ops"]),
+            # assigned_only=1 (samo uporabljeni) in sortiranje po priljubljenosti
+            models.Index(
+                fields=["user", "name"], condition=models.Q(recipe_count__gt=0),
+                name="core_tag_assigned_idx",
+            ),
+            models.Index(fields=["user", "-recipe_count", "-id"], name="core_tag_popular_idx"),
+        ]
+        constraints = [
+            # Ime je unikatno za uporabnika - omogoča ON CONFLICT upsert in
+            # podpira lookup po imenu ter ORDER BY name (index na user_id, name)
+            models.UniqueConstraint(fields=["user", "name"], name="core_tag_user_name_uniq"),
+        ]
+
     #String representation of the object
     def __str__(self):
         return self.name
 
-class Ingredient(models.Model):
+class Ingredient(DatabaseMaintainedFieldsMixin, models.Model):
     """Ingredient for recipes."""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
@@ -112,5 +241,64 @@ class Ingredient(models.Model):
         on_delete=models.CASCADE,
     )
 
+    #Število receptov s to sestavino (nastavlja trigger v bazi, migracija 0012)
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    db_maintained_fields = ("recipe_count",)
+
+    class Meta:
+        indexes = [
+            # Trigram index za autocomplete (pg_trgm)
+            GinIndex(fields=["name"], name="core_ingredient_name_trgm_idx", opclasses=["gin_trgm_ops"]),
+            # assigned_only=1 (samo uporabljeni) in sortiranje po priljubljenosti
+            models.Index(
+                fields=["user", "name"], condition=models.Q(recipe_count__gt=0),
+                name="core_ingredient_assigned_idx",
+            ),
+            models.Index(fields=["user", "-recipe_count", "-id"], name="core_ingredient_popular_idx"),
+        ]
+        constraints = [
+            # Ime je unikatno za uporabnika - omogoča ON CONFLICT upsert in
+            # podpira lookup po imenu ter ORDER BY name (index na user_id, name)
+            models.UniqueConstraint(fields=["user", "name"], name="core_ingredient_user_name_uniq"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ImageBlob(models.Model):
+    """Stored recipe image file and the number of recipes using it."""
+    name = models.CharField(max_length=100, primary_key=True) # enako kot Recipe.image (ime v storage-u)
+
+    #OPOMBA: Oba stolpca nastavlja trigger v bazi (migracija 0018) ob spremembi Recipe.image
+    refcount = models.PositiveIntegerField(default=0)
+    #Kdaj je datoteka ostala brez receptov (NULL, dokler jo kak recept uporablja)
+    released_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # Datoteke brez receptov (za brisanje)
+            models.Index(
+                fields=["released_at"], condition=models.Q(refcount=0),
+                name="core_imageblob_released_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.name
+
+
+class RecipeDuplicates(models.Model):
+    """Last computed groups of near-duplicate recipes of a user (recipe/dedup.py)."""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+    )
+
+    #Seznam skupin ID-jev receptov (največje najprej). Izračuna ga task v ozadju -
+    #recepti, ki so bili medtem izbrisani, so lahko še v seznamu.
+    clusters = models.JSONField(default=list)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user}: {len(self.clusters)} groups"
@@ -0,0 +1,97 @@
+"""
+Content-addressed file storage.
+
+A file is named by the SHA-256 of its content, in sharded directories under
+the upload directory: uploads/recipe/<h[:2]>/<h[2:4]>/<h>.<ext>. Identical
+bytes always map to the same name: the extension comes from the image
+format Pillow detects, not from the client's filename. The second save of the same content only
+returns the existing name and writes nothing. The content behind a name
+never changes, so its URL can be cached forever.
+
+How many recipes use a file is counted in ImageBlob (trigger from
+migration 0018).
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from PIL import Image
+
+
+# <dir>/ab/cd/abcd...(64 hex znakov).<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r"(.+/)?([0-9a-f]{2})/([0-9a-f]{2})/\2\3[0-9a-f]{60}\.\w+")
+
+# Končnica za format, ki ga zazna Pillow (ostali formati dobijo prvo končnico, ki jo Pillow pozna)
+IMAGE_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif"}
+
+
+def is_content_addressed(name):
+    """Return whether `name` is a content-addressed file (its content never changes)."""
+    return CONTENT_ADDRESSED_NAME.fullmatch(name) is not None
+
+
+def content_hash(content):
+    """Return the SHA-256 hex digest of a file (computed while it was uploaded, if possible)."""
+    # StreamingImageUploadHandler (recipe/uploads.py) izračuna hash že med upload-om
+    digest = getattr(content, "sha256", None)
+    if digest is not None:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def image_extension(content):
+    """Return the extension of the image format in `content` (None if it is not an image)."""
+    # ImageField (forms/DRF) sliko že preveri in jo shrani na datoteko
+    image = getattr(content, "image", None)
+    image_format = getattr(image, "format", None)
+    if image_format is None:
+        # Image.open prebere samo glavo
+        try:
+            content.seek(0)
+            with Image.open(content) as image:
+                image_format = image.format
+        except Exception:
+            return None
+        finally:
+            content.seek(0)
+    if image_format in IMAGE_EXTENSIONS:
+        return IMAGE_EXTENSIONS[image_format]
+    extensions = [
+        extension for extension, name in Image.registered_extensions().items()
+        if name == image_format
+    ]
+    return extensions[0] if extensions else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files by their content hash."""
+
+    def content_name(self, name, content):
+        """Return the storage name of `content` (in the directory of `name`)."""
+        digest = content_hash(content)
+        directory, filename = os.path.split(name)
+        # Končnica iz imena samo za datoteke, ki niso slike
+        extension = image_extension(content) or os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest[2:4], f"{digest}{extension}")
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.content_name(name, content)
+
+        if self.exists(name):
+            # Datoteke ne pišemo znova, samo osvežimo čas spremembe (datoteka je spet v uporabi)
+            os.utime(self.path(name))
+            return name
+        # Sočasen upload istih bajtov lahko tu dobi ime s pripono (get_available_name) -
+        # datoteka je pravilna, le ne deli se z drugimi
+        return super().save(name, content, max_length)
@@ -1,13 +1,22 @@
 """
 Test custom Django management commands.
 """
+from decimal import Decimal
+from io import BytesIO, StringIO
+import os
+import tempfile
 from unittest.mock import patch
 
+from PIL import Image
 from psycopg2 import OperationalError as Psycopg2OpError
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.management import call_command
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+
+from core.models import ImageBlob, Recipe, RecipeDuplicates, Tag
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -52,3 +61,209 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class BenchmarkCommandTests(TestCase):
+    """Test the benchmark command."""
+
+    def test_benchmark_filters_rolls_back(self):
+        """Test the benchmark runs and leaves no generated data behind."""
+        out = StringIO()
+
+        call_command('benchmark_recipes', 'filters', recipes=50, repeat=1, stdout=out)
+
+        self.assertIn('GROUP BY / HAVING', out.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_benchmark_search_matches(self):
+        """Test the search benchmark measures a query that matches generated recipes."""
+        out = StringIO()
+
+        call_command('benchmark_recipes', 'search', recipes=100, repeat=1, stdout=out)
+
+        self.assertIn('5 matching recipes', out.getvalue())
+
+
+class ReconcileRecipeCountsCommandTests(TestCase):
+    """Test the recipe count reconcile command."""
+
+    def test_reconcile_recipe_counts(self):
+        """Test wrong counters are recounted from the recipe relations."""
+        user = get_user_model().objects.create_user('user@example.com', 'test123')
+        tag = Tag.objects.create(user=user, name='Dinner')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'),
+        )
+        recipe.tags.add(tag)
+        Tag.objects.filter(id=tag.id).update(recipe_count=10)
+        out = StringIO()
+
+        call_command('reconcile_recipe_counts', stdout=out)
+
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 1)
+        self.assertIn('tags: fixed 1', out.getvalue())
+        self.assertIn('ingredients: fixed 0', out.getvalue())
+
+
+class BuildSimilarityIndexCommandTests(TestCase):
+    """Test the similarity index build command."""
+
+    def test_build_similarity_index(self):
+        """Test an index file is written for every user with recipes."""
+        user = get_user_model().objects.create_user('user@example.com', 'test123')
+        get_user_model().objects.create_user('other@example.com', 'test123')
+        Recipe.objects.create(user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        out = StringIO()
+
+        with tempfile.TemporaryDirectory() as index_dir, \
+                self.settings(RECIPE_SIMILARITY_DIR=index_dir):
+            call_command('build_similarity_index', stdout=out)
+
+            self.assertEqual(os.listdir(index_dir), [f'user-{user.id}.npz'])
+        self.assertEqual(out.getvalue(), f'user {user.id}: 1 recipes\n')
+
+
+class FindDuplicateRecipesCommandTests(TestCase):
+    """Test the duplicate recipes command."""
+
+    def test_find_duplicate_recipes(self):
+        """Test groups of near-duplicate recipes are reported per user."""
+        user = get_user_model().objects.create_user('user@example.com', 'test123')
+        recipes = [
+            Recipe.objects.create(user=user, title=title, time_minutes=5, price=Decimal('1.00'))
+            for title in ('Tomato soup', 'Tomato soup!', 'Chicken curry')
+        ]
+        out = StringIO()
+
+        call_command('find_duplicate_recipes', stdout=out)
+
+        self.assertEqual(out.getvalue(), (
+            'hashed 3 recipes\n'
+            f'user {user.id}: 1 groups\n'
+            f'  #{recipes[0].id} Tomato soup, #{recipes[1].id} Tomato soup!\n'
+        ))
+        self.assertEqual(
+            RecipeDuplicates.objects.get(user=user).clusters, [[recipes[0].id, recipes[1].id]],
+        )
+
+
+class GenerateImageDerivativesCommandTests(TestCase):
+    """Test the image derivatives backfill command."""
+
+    # Povezave v testni transakciji ne smemo zapreti
+    @patch('core.management.commands.generate_image_derivatives.connection')
+    def test_generate_image_derivatives(self, patched_connection):
+        """Test derivatives are generated for images without them."""
+        user = get_user_model().objects.create_user('user@example.com', 'test123')
+        recipe = Recipe.objects.create(user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        broken = Recipe.objects.create(user=user, title='Stew', time_minutes=5, price=Decimal('1.00'))
+        Recipe.objects.create(user=user, title='Salad', time_minutes=5, price=Decimal('1.00'))
+        out, err = StringIO(), StringIO()
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            buffer = BytesIO()
+            Image.new('RGB', (40, 30)).save(buffer, 'JPEG')
+            recipe.image.save('soup.jpg', ContentFile(buffer.getvalue()))
+            broken.image.save('stew.jpg', ContentFile(b'not an image'))
+
+            call_command('generate_image_derivatives', workers=2, stdout=out, stderr=err)
+
+        recipe.refresh_from_db()
+        self.assertEqual(set(recipe.image_derivatives), {'thumb', 'medium', 'large'})
+        self.assertEqual(recipe.image_derivatives['thumb']['width'], 40)
+        self.assertEqual(out.getvalue(), 'generated 1, failed 1\n')
+        self.assertIn(f'recipe {broken.id}', err.getvalue())
+        patched_connection.close.assert_called_once()
+
+    @patch('core.management.commands.generate_image_derivatives.time.sleep')
+    @patch('core.management.commands.generate_image_derivatives.connection')
+    def test_generate_image_derivatives_watch(self, patched_connection, patched_sleep):
+        """Test the image worker keeps generating derivatives and skips broken images."""
+        # Drugi sleep() ustavi zanko
+        patched_sleep.side_effect = [None, StopIteration]
+        user = get_user_model().objects.create_user('user@example.com', 'test123')
+        recipe = Recipe.objects.create(user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        broken = Recipe.objects.create(user=user, title='Stew', time_minutes=5, price=Decimal('1.00'))
+        out, err = StringIO(), StringIO()
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            buffer = BytesIO()
+            Image.new('RGB', (40, 30)).save(buffer, 'PNG')
+            recipe.image.save('soup.png', ContentFile(buffer.getvalue()))
+            broken.image.save('stew.jpg', ContentFile(b'not an image'))
+
+            with self.assertRaises(StopIteration):
+                call_command(
+                    'generate_image_derivatives', watch=True, workers=1, stdout=out, stderr=err,
+                )
+
+        recipe.refresh_from_db()
+        self.assertEqual(set(recipe.image_derivatives), {'thumb', 'medium', 'large'})
+        self.assertEqual(out.getvalue(), 'generated 1, failed 1\n')
+        self.assertEqual(err.getvalue().count(f'recipe {broken.id}'), 1)
+        self.assertEqual(patched_sleep.call_count, 2)
+
+
+class CollectOrphanImagesCommandTests(TestCase):
+    """Test the orphaned images garbage collector."""
+
+    def test_collect_orphan_images(self):
+        """Test old unreferenced images and derivatives are deleted, others are kept."""
+        user = get_user_model().objects.create_user('user@example.com', 'test123')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'),
+            image='uploads/recipe/used.jpg',
+        )
+        Recipe.objects.create(
+            user=user, title='Stew', time_minutes=5, price=Decimal('1.00'),
+            image='uploads/recipe/old.jpg',
+        ).delete()
+        files = [
+            'uploads/recipe/used.jpg', 'uploads/recipe/derivatives/used/thumb.webp',
+            'uploads/recipe/old.jpg', 'uploads/recipe/derivatives/old/thumb.webp',
+            'uploads/recipe/new.jpg',
+        ]
+        orphans = ['uploads/recipe/old.jpg', 'uploads/recipe/derivatives/old/thumb.webp']
+
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root, RECIPE_IMAGE_GC_GRACE=3600):
+            for name in files:
+                path = os.path.join(media_root, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(b'12345')
+                if name != 'uploads/recipe/new.jpg':
+                    os.utime(path, (0, 0))
+
+            out = StringIO()
+            call_command('collect_orphan_images', dry_run=True, stdout=out)
+            *names, summary = out.getvalue().splitlines()
+            self.assertEqual(sorted(names), sorted(orphans))
+            self.assertEqual(summary, 'would delete 2 files (10 bytes)')
+            self.assertTrue(all(os.path.exists(os.path.join(media_root, name)) for name in files))
+
+            out = StringIO()
+            call_command('collect_orphan_images', stdout=out)
+            self.assertEqual(out.getvalue(), 'deleted 2 files (10 bytes)\n')
+            self.assertEqual(
+                [name for name in files if os.path.exists(os.path.join(media_root, name))],
+                [name for name in files if name not in orphans],
+            )
+            self.assertFalse(os.path.exists(os.path.join(media_root, 'uploads/recipe/derivatives/old')))
+
+        self.assertEqual(list(ImageBlob.objects.values_list('name', flat=True)), [recipe.image.name])
+
+
+class CacheStatsCommandTests(SimpleTestCase):
+    """Test the cache statistics command."""
+
+    @patch('recipe.cache.get_stats')
+    def test_recipe_cache_stats(self, patched_stats):
+        """Test hit/miss counters and the hit ratio are reported."""
+        patched_stats.return_value = {'hits': 3, 'misses': 1}
+        out = StringIO()
+
+        call_command('recipe_cache_stats', stdout=out)
+
+        self.assertIn('hits=3 misses=1 hit_ratio=75.00%', out.getvalue())
@@ -2,9 +2,17 @@
 Tests for models.
 """
 
+import hashlib
+import os
+import tempfile
+from io import BytesIO
 from unittest.mock import patch #This is the tool we use to mock things (replace behaviour for the purpose of testing)
 from decimal import Decimal
 
+from PIL import Image
+
+from django.core.files.base import ContentFile
+from django.db import IntegrityError
 from django.test import TestCase
 from django.contrib.auth import get_user_model #Je dobro da uporabiš to metodo, da dobiš referenco do svojega custom user modela
 
@@ -91,6 +99,104 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(tag), tag.name)
 
+    def test_tag_name_unique_per_user(self):
+        """Test a user cannot have two tags with the same name."""
+        user = create_user()
+        other_user = create_user(email="other@example.com")
+        models.Tag.objects.create(user=user, name="Tag1")
+        models.Tag.objects.create(user=other_user, name="Tag1")
+
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name="Tag1")
+
+    def test_recipe_ingredient_ids(self):
+        """Test ingredient_ids follows the ingredients and survives save()."""
+        user = create_user()
+        salt, pepper = [
+            models.Ingredient.objects.create(user=user, name=name)
+            for name in ("Salt", "Pepper")
+        ]
+        recipe = models.Recipe.objects.create(
+            user=user, title="Soup", time_minutes=5, price=Decimal("1.00"),
+        )
+
+        recipe.ingredients.add(salt, pepper)
+        recipe.ingredients.remove(salt)
+        recipe.title = "Pepper soup"
+        recipe.save() # ingredient_ids v Pythonu je še prazen
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredient_ids, [pepper.id])
+        self.assertEqual(recipe.title, "Pepper soup")
+
+    def test_recipe_minhash_cleared_on_change(self):
+        """Test the MinHash signature is cleared when title or ingredients change."""
+        user = create_user()
+        salt = models.Ingredient.objects.create(user=user, name="Salt")
+        recipes = [
+            models.Recipe.objects.create(
+                user=user, title=f"Soup {i}", time_minutes=5, price=Decimal("1.00"),
+            )
+            for i in range(3)
+        ]
+        models.Recipe.objects.update(minhash=[1, 2], lsh_bands=[3])
+
+        recipes[0].ingredients.add(salt)
+        models.Recipe.objects.filter(id=recipes[1].id).update(title="Stew")
+        models.Recipe.objects.filter(id=recipes[2].id).update(time_minutes=10)
+
+        self.assertEqual(
+            [(r.minhash, r.lsh_bands) for r in models.Recipe.objects.order_by("id")],
+            [(None, None), (None, None), ([1, 2], [3])],
+        )
+
+    def test_tag_recipe_count(self):
+        """Test the recipe count follows adding, removing and deleting recipes."""
+        user = create_user()
+        tag = models.Tag.objects.create(user=user, name="Tag1")
+        recipes = [
+            models.Recipe.objects.create(
+                user=user, title=f"Recipe {i}", time_minutes=5, price=Decimal("1.00"),
+            )
+            for i in range(3)
+        ]
+        stale = models.Tag.objects.get(id=tag.id)
+
+        for recipe in recipes:
+            recipe.tags.add(tag)
+        recipes[0].tags.remove(tag)
+        recipes[1].delete()
+        stale.name = "Renamed"
+        stale.save() # Ne sme prepisati števca z zastarelo vrednostjo
+
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, "Renamed")
+        self.assertEqual(tag.recipe_count, 1)
+
+    def test_image_blob_refcount(self):
+        """Test recipes using an image file are counted and the release is recorded."""
+        user = create_user()
+        recipes = [
+            models.Recipe.objects.create(
+                user=user, title=f"Recipe {i}", time_minutes=5, price=Decimal("1.00"),
+                image="uploads/recipe/shared.jpg",
+            )
+            for i in range(3)
+        ]
+
+        recipes[0].delete()
+        recipes[1].image = "uploads/recipe/other.jpg"
+        recipes[1].save()
+        recipes[2].save() # Slika se ni spremenila - števec ostane
+        shared = models.ImageBlob.objects.get(name="uploads/recipe/shared.jpg")
+        self.assertEqual((shared.refcount, shared.released_at), (1, None))
+
+        recipes[2].delete()
+        shared.refresh_from_db()
+        self.assertEqual(shared.refcount, 0)
+        self.assertIsNotNone(shared.released_at)
+        self.assertEqual(models.ImageBlob.objects.get(name="uploads/recipe/other.jpg").refcount, 1)
+
 
     #----------
     #TESTS FOR INGREDIENTS
@@ -124,4 +230,47 @@ class ModelTests(TestCase):
         # A function that generates the path to the image that is being uploaded.
         file_path = models.recipe_image_file_path(None, "example.jpg")
 
-        self.assertEqual(file_path, f'uploads/recipe/{uuid}.jpg')
\ No newline at end of file
+        self.assertEqual(file_path, f'uploads/recipe/{uuid}.jpg')
+
+    def test_recipe_image_content_addressed(self):
+        """Test identical images are stored once under their SHA-256."""
+        user = create_user()
+        content = b"same bytes"
+        digest = hashlib.sha256(content).hexdigest()
+        recipes = [
+            models.Recipe.objects.create(
+                user=user, title=f"Recipe {i}", time_minutes=5, price=Decimal("1.00"),
+            )
+            for i in range(2)
+        ]
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            for recipe in recipes:
+                recipe.image.save("photo.JPG", ContentFile(content))
+            with patch("django.core.files.storage.FileSystemStorage._save") as patched_save:
+                recipes[0].image.save("copy.jpg", ContentFile(content))
+
+            name = f"uploads/recipe/{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+            self.assertEqual([recipe.image.name for recipe in recipes], [name, name])
+            self.assertEqual(os.listdir(os.path.dirname(recipes[0].image.path)), [f"{digest}.jpg"])
+            patched_save.assert_not_called()
+        self.assertEqual(models.ImageBlob.objects.get(name=name).refcount, 2)
+
+    def test_recipe_image_extension_from_format(self):
+        """Test the same image under different file names is stored once, named by its format."""
+        user = create_user()
+        recipe = models.Recipe.objects.create(
+            user=user, title="Recipe", time_minutes=5, price=Decimal("1.00"),
+        )
+        buffer = BytesIO()
+        Image.new("RGB", (10, 10)).save(buffer, format="JPEG")
+        digest = hashlib.sha256(buffer.getvalue()).hexdigest()
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            names = set()
+            for filename in ("photo.jpg", "photo.jpeg", "PHOTO.JPG", "photo.png"):
+                recipe.image.save(filename, ContentFile(buffer.getvalue()))
+                names.add(recipe.image.name)
+
+            self.assertEqual(names, {f"uploads/recipe/{digest[:2]}/{digest[2:4]}/{digest}.jpg"})
+            self.assertEqual(os.listdir(os.path.dirname(recipe.image.path)), [f"{digest}.jpg"])
@@ -0,0 +1,100 @@
+"""
+Per-user versioned cache for recipe API responses.
+
+Every cached response key contains the user's current data version.
+Any change to the user's recipes, tags or ingredients bumps the version
+(see recipe/signals.py), which makes all older keys unreachable at once -
+no key scans or deletes are needed, old entries simply expire.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+VERSION_KEY = "recipe:version:{user_id}"
+RESPONSE_KEY = "recipe:response:{user_id}:{version}:{digest}"
+STATS_KEY = "recipe:stats:{name}"
+
+
+def get_cache():
+    """Return the cache backend used for recipe responses."""
+    return caches[settings.RECIPE_CACHE_ALIAS]
+
+
+def _new_version():
+    #OPOMBA: Verzija se začne s časom (ns) in ne z 1 - če cache ključ z verzijo izgubi
+    #(restart, eviction), nova verzija ne more zadeti starih odgovorov.
+    return time.time_ns()
+
+
+def get_version(user_id):
+    """Return the current data version of the user."""
+    cache = get_cache()
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(user_id):
+    cache = get_cache()
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ključa ni (še ni bil prebran ali je bil izbrisan)
+        cache.set(key, _new_version(), timeout=None)
+
+
+def bump_version(user_id):
+    """Invalidate all cached responses of the user in O(1)."""
+    _bump(user_id)
+    # Še enkrat po commit-u: request, ki je med tem prebral stare podatke,
+    # jih je shranil pod verzijo, ki po commit-u ni več aktualna.
+    transaction.on_commit(lambda: _bump(user_id))
+
+
+def response_key(request):
+    """Return the cache key of the response to `request`."""
+    digest = hashlib.sha1(request.build_absolute_uri().encode("utf-8")).hexdigest()
+    return RESPONSE_KEY.format(
+        user_id=request.user.id,
+        version=get_version(request.user.id),
+        digest=digest,
+    )
+
+
+def get_response(key):
+    """Return cached response data or None, and count the hit/miss."""
+    data = get_cache().get(key)
+    _count("hits" if data is not None else "misses")
+    return data
+
+
+def set_response(key, data):
+    """Store response data under `key`."""
+    get_cache().set(key, data, timeout=settings.RECIPE_CACHE_TIMEOUT)
+
+
+def _count(name):
+    cache = get_cache()
+    key = STATS_KEY.format(name=name)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_stats():
+    """Return the hit/miss counters."""
+    cache = get_cache()
+    return {
+        name: cache.get(STATS_KEY.format(name=name), 0)
+        for name in ("hits", "misses")
+    }
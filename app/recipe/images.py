@@ -0,0 +1,121 @@
+"""
+Resized derivatives of recipe images (RECIPE_IMAGE_SIZES, WebP and JPEG).
+
+The upload request only stores the original. Derivatives are generated by
+a separate process, the image worker (generate_image_derivatives --watch),
+which picks up recipes with an image but no derivatives (pending()). Only
+JPEG can be scaled down while decoding (draft()); PNG and WebP are decoded
+in full, up to RECIPE_IMAGE_MAX_PIXELS. Keeping that out of the uwsgi
+workers keeps their memory bounded by the upload budget alone.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from core.models import Recipe
+from recipe import cache
+
+
+# Končnica -> (Pillow format, nastavitve kodiranja)
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+# Različice slike <dir>/<ime>.<ext> so v <dir>/derivatives/<ime>/<velikost>.<format>
+DERIVATIVES_DIR = "derivatives"
+
+
+def derivative_dir(image_name):
+    """Return the storage directory with the derivatives of `image_name`."""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return os.path.join(os.path.dirname(image_name), DERIVATIVES_DIR, stem)
+
+
+def derivative_source(name):
+    """Return the name prefix of the image a derivative belongs to (None for other files)."""
+    directory, stem = os.path.split(os.path.dirname(name))
+    parent, derivatives = os.path.split(directory)
+    if derivatives != DERIVATIVES_DIR or not stem:
+        return None
+    # Končnice slike iz imena različice ne poznamo
+    return os.path.join(parent, f"{stem}.")
+
+
+def derivative_name(image_name, size, extension):
+    """Return the storage name of one derivative of `image_name`."""
+    return os.path.join(derivative_dir(image_name), f"{size}.{extension}")
+
+
+def _rgb(image):
+    """Return the image in RGB (JPEG has no alpha - transparency becomes white)."""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def generate(image_name):
+    """Write the derivatives of a stored image and return their description."""
+    sizes = sorted(settings.RECIPE_IMAGE_SIZES.items(), key=lambda item: -item[1])
+    largest = sizes[0][1]
+    with default_storage.open(image_name) as f:
+        image = Image.open(f)
+        # JPEG dekoder zna sliko pomanjšati že pri dekodiranju (DCT scaling)
+        image.draft("RGB", (largest, largest))
+        image = _rgb(ImageOps.exif_transpose(image))
+
+    derivatives = {}
+    for size, max_px in sizes:
+        # Vsako manjšo različico naredimo iz prejšnje (manj pikslov za resampling)
+        image.thumbnail((max_px, max_px), Image.LANCZOS)
+        derivative = {"width": image.width, "height": image.height}
+        for extension, (image_format, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, **options)
+            name = derivative_name(image_name, size, extension)
+            default_storage.delete(name)
+            derivative[extension] = default_storage.save(name, ContentFile(buffer.getvalue()))
+        derivatives[size] = derivative
+    return derivatives
+
+
+def save(recipe_id, user_id, image_name, derivatives):
+    """Store derivatives on the recipe, unless its image was replaced meanwhile."""
+    #OPOMBA: update() ne sproži signalov - updated_at (ETag) in cache nastavimo sami
+    updated = Recipe.objects.filter(id=recipe_id, image=image_name).update(
+        image_derivatives=derivatives, updated_at=timezone.now(),
+    )
+    if updated:
+        cache.bump_version(user_id)
+    return bool(updated)
+
+
+def pending():
+    """Return the recipes whose image has no derivatives yet."""
+    # Enak pogoj kot delni indeks core_recipe_no_derivatives_idx
+    return Recipe.objects.filter(image__gt="", image_derivatives={})
+
+
+def existing_derivatives(user_id, image_name):
+    """Return derivatives of `image_name` another recipe of the user already has (or None)."""
+    # Enaka slika ima enako ime (ContentAddressedStorage) - različice samo prepišemo
+    return (
+        Recipe.objects.filter(user_id=user_id, image=image_name)
+        .exclude(image_derivatives={})
+        .values_list("image_derivatives", flat=True)
+        .first()
+    )
+
+
+def update_derivatives(recipe_id, user_id, image_name):
+    """Generate and store the derivatives of one recipe image."""
+    derivatives = existing_derivatives(user_id, image_name)
+    return save(recipe_id, user_id, image_name, derivatives or generate(image_name))
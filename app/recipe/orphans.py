@@ -0,0 +1,153 @@
+"""
+Garbage collection of recipe image files no recipe references.
+
+Replaced and deleted recipe images (and their derivatives) stay in storage.
+collect() walks the upload directory one directory entry at a time
+(os.scandir) and checks files in batches against a Bloom filter of the
+referenced names, streamed from Recipe.image. Memory is bounded by the
+filter (about 3.6 bytes per referenced image: the image and its derivative
+directory) and one batch, not by the number of files. A false positive only
+keeps an orphan until a later run.
+
+Files younger than RECIPE_IMAGE_GC_GRACE are never deleted: an upload
+stores its file before the transaction that references it commits, and
+ContentAddressedStorage refreshes the mtime of files it reuses.
+"""
+import hashlib
+import itertools
+import math
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+
+from core.models import ImageBlob, Recipe, recipe_image_file_path
+from recipe import images
+
+
+BATCH_SIZE = 10000
+
+# Direktorij z naloženimi slikami (uploads/recipe)
+UPLOAD_DIR = os.path.dirname(recipe_image_file_path(None, ""))
+
+
+class BloomFilter:
+    """Set of strings with no false negatives and a bounded false positive rate."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2) + 1
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, keys):
+        # Dvojno zgoščevanje: k pozicij iz dveh 64-bitnih vrednosti enega hash-a
+        digests = b"".join(hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest() for key in keys)
+        h = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+        return (h[:, :1] + np.arange(self.hashes, dtype=np.uint64) * h[:, 1:]) % np.uint64(self.size)
+
+    def update(self, keys):
+        """Add the keys."""
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def contains(self, keys):
+        """Return a boolean array: which keys are (probably) in the set."""
+        positions = self._positions(keys)
+        return ((self.bits[positions >> 3] >> (positions & 7)) & 1).all(axis=1)
+
+
+def reference_key(name):
+    """Return the name under which a stored file is referenced (derivatives by their directory)."""
+    directory = os.path.dirname(name)
+    if os.path.basename(os.path.dirname(directory)) == images.DERIVATIVES_DIR:
+        return directory
+    return name
+
+
+def referenced_filter():
+    """Return a Bloom filter of every referenced image and derivative directory."""
+    names = Recipe.objects.exclude(image="").exclude(image__isnull=True).values_list("image", flat=True)
+    bloom = BloomFilter(2 * names.count())
+    # iterator() bere s strežniškim kurzorjem - imen ne naložimo vseh naenkrat
+    for batch in _batched(names.iterator(chunk_size=BATCH_SIZE), BATCH_SIZE):
+        bloom.update(batch + [images.derivative_dir(name) for name in batch])
+    return bloom
+
+
+def walk(path):
+    """Yield the files under `path` (os.DirEntry), reading directories lazily."""
+    if not os.path.isdir(path):
+        return
+    directories = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+    for directory in directories:
+        yield from walk(directory)
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def orphans(bloom, storage, cutoff):
+    """Yield (name, size) of stored files older than `cutoff` that are not in `bloom`."""
+    def old_files():
+        for entry in walk(storage.path(UPLOAD_DIR)):
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < cutoff:
+                yield os.path.relpath(entry.path, storage.location), stat.st_size
+
+    for batch in _batched(old_files(), BATCH_SIZE):
+        referenced = bloom.contains([reference_key(name) for name, _ in batch])
+        for (name, size), is_referenced in zip(batch, referenced):
+            if not is_referenced:
+                yield name, size
+
+
+def delete(storage, names, cutoff):
+    """Delete orphaned files and return the names actually deleted."""
+    #OPOMBA: Bloom filter je posnetek - preden brišemo, preverimo števec (ImageBlob) in
+    #starost datoteke še enkrat (slika se je medtem lahko spet uporabila)
+    in_use = set(
+        ImageBlob.objects.filter(name__in=names, refcount__gt=0).values_list("name", flat=True)
+    )
+    deleted = []
+    for name in names:
+        path = storage.path(name)
+        try:
+            if name in in_use or os.stat(path).st_mtime >= cutoff:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        deleted.append(name)
+        if reference_key(name) != name:
+            # Prazen direktorij z različicami pobrišemo (rmdir ne uspe, dokler ni prazen)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+    ImageBlob.objects.filter(name__in=deleted, refcount=0).delete()
+    return deleted
+
+
+def collect(dry_run=False, limit=None):
+    """Delete orphaned image files; yield (name, size) of every deleted (or, dry run, orphaned) file."""
+    storage = Recipe._meta.get_field("image").storage
+    cutoff = time.time() - settings.RECIPE_IMAGE_GC_GRACE
+    found = itertools.islice(orphans(referenced_filter(), storage, cutoff), limit)
+    for batch in _batched(found, BATCH_SIZE):
+        if dry_run:
+            yield from batch
+            continue
+        sizes = dict(batch)
+        for name in delete(storage, list(sizes), cutoff):
+            yield name, sizes[name]
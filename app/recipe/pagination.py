@@ -0,0 +1,158 @@
+"""
+Pagination for recipe APIs.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """Keyset (seek) pagination over the ordering of the queryset.
+
+    Unlike DRF's CursorPagination, which only seeks on the first ordering
+    field and falls back to OFFSET for ties, the cursor stores the values of
+    every ordering column, so each page is one index range scan at any depth.
+    """
+
+    #OPOMBA: Vrstni red vzamemo iz queryset-a (order_by), zadnje polje mora biti
+    #unikatno - če ga ni, dodamo "id" (tie-breaker).
+    ordering = ("-id",)
+    tiebreaker = "id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        """Return the ordering of the queryset, ending with a unique field."""
+        ordering = [
+            field for field in queryset.query.order_by if isinstance(field, str)
+        ] or list(self.ordering)
+
+        if ordering[-1].lstrip("-") != self.tiebreaker:
+            direction = "-" if ordering[0].startswith("-") else ""
+            ordering.append(direction + self.tiebreaker)
+
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        position, reverse = self.cursor if self.cursor else (None, False)
+
+        # Pri listanju nazaj obrnemo vrstni red, na koncu pa obrnemo še rezultate
+        ordering = self._reverse(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self._seek(ordering, position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        return self.page
+
+    def _reverse(self, ordering):
+        """Flip the direction of every ordering field."""
+        return tuple(
+            field[1:] if field.startswith("-") else "-" + field
+            for field in ordering
+        )
+
+    def _seek(self, ordering, position):
+        """Build the filter selecting rows strictly after `position`.
+
+        For ordering (a, b) this is `a > x OR (a = x AND b > y)`, AND-ed with
+        `a >= x` so the leading column stays an index range condition.
+        """
+        if len(position) != len(ordering):
+            raise ValueError("Cursor does not match ordering.")
+
+        names = [field.lstrip("-") for field in ordering]
+        seek = Q()
+        for i, field in enumerate(ordering):
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition = Q(**{f"{names[i]}__{lookup}": position[i]})
+            for name, value in zip(names[:i], position[:i]):
+                condition &= Q(**{name: value})
+            seek |= condition
+
+        bound = "lte" if ordering[0].startswith("-") else "gte"
+        return Q(**{f"{names[0]}__{bound}": position[0]}) & seek
+
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for field in ordering:
+            name = field.lstrip("-")
+            if isinstance(instance, dict):
+                value = instance[name]
+            else:
+                value = getattr(instance, name)
+            if isinstance(value, Decimal):
+                value = str(value)
+            elif hasattr(value, "isoformat"):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        else:
+            position = self.cursor[0]
+        return self.encode_cursor((position, False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        else:
+            position = self.cursor[0]
+        return self.encode_cursor((position, True))
+
+    def decode_cursor(self, request):
+        """Return (position, reverse) from the request, or None."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            position, reverse = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, bool(reverse)
+
+    def encode_cursor(self, cursor):
+        """Return the URL with the opaque (base64) cursor."""
+        encoded = urlsafe_b64encode(
+            json.dumps(cursor, separators=(",", ":")).encode("utf-8")
+        ).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
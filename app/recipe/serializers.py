@@ -2,6 +2,18 @@
 Serializers for recipe APIs
 """
 
+from collections import defaultdict
+import warnings
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Func, IntegerField, Value
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
+from PIL import Image
 from rest_framework import serializers
 
 from core.models import (
@@ -9,6 +21,226 @@ from core.models import (
     Tag,
     Ingredient,
 )
+from recipe import cache, images, similarity
+
+def _split_param(value):
+    """Split a comma separated query parameter into a set of names."""
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def select_fields(serializer_class, query_params):
+    """Return the fields selected with ?fields= and ?include=, or None for all.
+
+    `fields` selects plain attributes, `include` selects nested relations
+    (`expandable_fields`). A relation listed in `fields` is included as well,
+    and `id` is always returned.
+    """
+    fields_param = query_params.get("fields")
+    include_param = query_params.get("include")
+    if fields_param is None and include_param is None:
+        return None
+
+    available = list(serializer_class.Meta.fields)
+    expandable = getattr(serializer_class, "expandable_fields", ())
+    fields = _split_param(fields_param) if fields_param is not None else None
+    include = _split_param(include_param) if include_param is not None else None
+
+    if fields is not None and fields - set(available):
+        raise serializers.ValidationError(
+            {"fields": f"Unknown fields: {', '.join(sorted(fields - set(available)))}."}
+        )
+    if include is not None and include - set(expandable):
+        raise serializers.ValidationError(
+            {"include": f"Unknown relations: {', '.join(sorted(include - set(expandable)))}."}
+        )
+
+    selected = []
+    for name in available:
+        if name == "id":
+            selected.append(name)
+        elif name in expandable:
+            if (include is not None and name in include) or \
+                    (fields is not None and name in fields):
+                selected.append(name)
+        elif fields is None or name in fields:
+            selected.append(name)
+    return selected
+
+
+class SparseFieldsMixin:
+    """Render only the fields selected in context["fields"] (see select_fields)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.context.get("fields")
+        if selected is not None:
+            for name in set(self.fields) - set(selected):
+                self.fields.pop(name)
+
+
+# Pretvorbe, ki dajo enak rezultat kot to_representation() teh polj
+FAST_CONVERTERS = {
+    serializers.CharField: str,
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+}
+
+
+def _converter(field):
+    """Return a function converting a raw value like `field` does."""
+    convert = FAST_CONVERTERS.get(type(field), field.to_representation)
+    return lambda value: None if value is None else convert(value)
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """List serializer with a read-only fast path for values() rows.
+
+    Model instances are serialized as usual. Rows from `.values()` are
+    converted with accessors prepared once per list instead of DRF's
+    per-row, per-field dispatch, and nested relations are loaded with one
+    query per relation. Both paths return the same data.
+    """
+
+    def to_representation(self, data):
+        if not isinstance(data, list) or not data or not isinstance(data[0], dict):
+            return super().to_representation(data)
+
+        ids = [row["id"] for row in data]
+        getters = []
+        for field in self.child._readable_fields:
+            if field.field_name in self.child.expandable_fields:
+                getter = self._relation_getter(field, ids)
+            else:
+                getter = self._column_getter(field)
+            getters.append((field.field_name, getter))
+
+        return [{name: get(row) for name, get in getters} for row in data]
+
+    def _column_getter(self, field):
+        source = field.source
+        convert = _converter(field)
+        return lambda row: convert(row[source])
+
+    def _relation_getter(self, field, ids):
+        """Load a nested M2M relation of all rows with one query."""
+        relation = self.child.Meta.model._meta.get_field(field.source)
+        owner = relation.m2m_field_name()
+        target = relation.m2m_reverse_field_name()
+        nested = [(f.field_name, _converter(f)) for f in field.child._readable_fields]
+
+        # Enak vrstni red kot prefetch v RecipeViewSet (po ID-ju)
+        #OPOMBA: "= ANY(array)" pošlje ID-je kot en parameter - "IN (...)" pri
+        #tisočih ID-jev porabi več časa za sestavljanje SQL-a kot za poizvedbo.
+        rows = relation.remote_field.through.objects.filter(
+            **{f"{owner}_id": Func(
+                Value(ids, output_field=ArrayField(IntegerField())),
+                function="ANY",
+                output_field=IntegerField(),
+            )}
+        ).order_by(f"{owner}_id", f"{target}_id").values_list(
+            f"{owner}_id", *[f"{target}__{name}" for name, _ in nested]
+        )
+
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[row[0]].append(
+                {name: convert(value) for (name, convert), value in zip(nested, row[1:])}
+            )
+        return lambda row: grouped.get(row["id"], [])
+
+    #OPOMBA: create/update se kličeta pri many=True (bulk endpoint). Signali za
+    #bulk_create/bulk_update se ne sprožijo, zato cache invalidiramo sami.
+    @transaction.atomic
+    def create(self, validated_data):
+        """Create all recipes with bulk inserts."""
+        model = self.child.Meta.model
+        relations = {
+            name: [attrs.pop(name, []) for attrs in validated_data]
+            for name in self.child.expandable_fields
+        }
+
+        instances = model.objects.bulk_create(model(**attrs) for attrs in validated_data)
+        for name, items in relations.items():
+            self._set_related(name, dict(zip(instances, items)), replace=False)
+
+        self._invalidate()
+        return instances
+
+    @transaction.atomic
+    def update(self, instances, validated_data):
+        """Update all recipes with one bulk update (instances match validated_data)."""
+        model = self.child.Meta.model
+        relations = {name: {} for name in self.child.expandable_fields}
+        fields = {"updated_at"}
+        now = timezone.now()
+        for instance, attrs in zip(instances, validated_data):
+            for name, changes in relations.items():
+                if name in attrs:
+                    changes[instance] = attrs.pop(name)
+            for attr, value in attrs.items():
+                setattr(instance, attr, value)
+                fields.add(attr)
+            # bulk_update ne nastavi auto_now polj
+            instance.updated_at = now
+
+        model.objects.bulk_update(instances, sorted(fields))
+        for name, changes in relations.items():
+            self._set_related(name, changes, replace=True)
+
+        self._invalidate()
+        return instances
+
+    def _set_related(self, name, changes, replace):
+        """Write the M2M rows of `changes` ({instance: items}) in bulk.
+
+        With `replace`, rows that are not in the new items are deleted, so only
+        the difference is written (like RelatedManager.set()).
+        """
+        if not changes:
+            return
+
+        relation = self.child.Meta.model._meta.get_field(name)
+        through = relation.remote_field.through
+        owner = f"{relation.m2m_field_name()}_id"
+        target = f"{relation.m2m_reverse_field_name()}_id"
+
+        objects = {
+            obj.name: obj
+            for obj in self.child._get_or_create_related(
+                relation.related_model,
+                [item for items in changes.values() for item in items],
+            )
+        }
+        wanted = {
+            (instance.pk, objects[item["name"]].pk)
+            for instance, items in changes.items()
+            for item in items
+        }
+
+        current = {}
+        if replace:
+            current = {
+                (owner_id, target_id): pk
+                for pk, owner_id, target_id in through.objects.filter(
+                    **{f"{owner}__in": [instance.pk for instance in changes]}
+                ).values_list("pk", owner, target)
+            }
+            stale = [pk for pair, pk in current.items() if pair not in wanted]
+            if stale:
+                through.objects.filter(pk__in=stale).delete()
+
+        through.objects.bulk_create(
+            [
+                through(**{owner: owner_id, target: target_id})
+                for owner_id, target_id in wanted
+                if (owner_id, target_id) not in current
+            ],
+            ignore_conflicts=True,
+        )
+
+    def _invalidate(self):
+        cache.bump_version(self.context["request"].user.id)
+
 
 #OPOMBA: Mora biti pred RecipeSerializer-jem, ker ga ta uporablja (nested)
 class TagSerializer(serializers.ModelSerializer):
@@ -28,18 +260,49 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ["id"]
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+@extend_schema_field(OpenApiTypes.OBJECT)
+class ImageDerivativesField(serializers.Field):
+    """Resized versions of the recipe image: {size: {width, height, webp, jpeg}}."""
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get("request")
+
+        def url(name):
+            # Enako kot ImageField - absoluten URL, če imamo request
+            url = default_storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+
+        return {
+            size: {
+                key: url(item) if key in images.FORMATS else item
+                for key, item in derivative.items()
+            }
+            for size, derivative in value.items()
+        }
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for recipes."""
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
+    #Pomanjšane slike za sezname (različice nastanejo po upload-u, do takrat je {})
+    image_derivatives = ImageDerivativesField()
+
+    #Vgnezdene relacije, ki jih client izbere z ?include=
+    expandable_fields = ("tags", "ingredients")
 
     class Meta:
         model = Recipe #S tem povemo Django frameworku, da bomo uporabili Recipe model s tem serializer-jem
         fields = [
             'id', 'title', 'time_minutes', 'price', 'link', 'tags',
-            'ingredients'
+            'ingredients', 'image_derivatives',
             ]
         read_only_fields = ['id']
+        list_serializer_class = RecipeListSerializer
 
     #Naredimo pomožno metodo
     #OPOMBA: Interne metode označimo s podčrtajem v imenu.
@@ -47,30 +310,49 @@ class RecipeSerializer(serializers.ModelSerializer):
     #Pomeni, da želimo da je "private" (ni pa tehnično to res "private" - še vedno jo lahko kličemo od zunaj - samo dogovor je tak)
     def _get_or_create_tags(self, tags, recipe):
         """Handle getting or creating tags as needed."""
-        auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag,
-            )
-            recipe.tags.add(tag_obj)
+        recipe.tags.add(*self._get_or_create_related(Tag, tags))
 
     def _get_or_create_ingredients(self, ingredients, recipe):
         """Handle getting or creating ingredients as needed."""
-        auth_user = self.context["request"].user
-        for ingredient in ingredients:
-            #Dodamo zapis v šifrant (ingredients)
-            ingredient_obj, create = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingredient,
+        #Povežemo zapise z receptom (relacija) - en bulk insert v "through" tabelo
+        recipe.ingredients.add(*self._get_or_create_related(Ingredient, ingredients))
+
+    def _get_or_create_related(self, model, items):
+        """Return the user's objects with the given names, creating missing ones.
+
+        Costs a constant number of queries regardless of the number of items
+        (instead of one get_or_create per item).
+        """
+        auth_user = self.context['request'].user
+        names = list(dict.fromkeys(item['name'] for item in items))
+        if not names:
+            return []
+
+        objects = {
+            obj.name: obj
+            for obj in model.objects.filter(user=auth_user, name__in=names)
+        }
+        missing = [name for name in names if name not in objects]
+        if missing:
+            #OPOMBA: ignore_conflicts = INSERT ... ON CONFLICT DO NOTHING na unikatnem (user, name).
+            #Če je isto ime medtem vstavil drug request, ne dobimo napake (ne potrebujemo retry-ja).
+            #ON CONFLICT ne vrne ID-jev, zato nove zapise ponovno preberemo.
+            model.objects.bulk_create(
+                [model(user=auth_user, name=name) for name in missing],
+                ignore_conflicts=True,
             )
-            #Povežemo zapis z receptom (relacija)
-            recipe.ingredients.add(ingredient_obj)
+            objects.update(
+                (obj.name, obj)
+                for obj in model.objects.filter(user=auth_user, name__in=missing)
+            )
+
+        return [objects[name] for name in names]
 
 
 
     #OPOMBA: Ker so "nested" serializer-ji po defaultu READ-ONLY, mi pa želimo tudi dodajati tag-e, moramo
     #narediti override te metode
+    @transaction.atomic
     def create(self, validated_data):
         """Create a recipe."""
         #Naredimo custom logiko za kreiranje objekta preko tega serializer-ja
@@ -104,6 +386,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         return recipe
 
     #OPOMBA: Z override te metode omogočimo ažuriranje vgnezdenih serializer-jev
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Update recipe."""
 
@@ -114,16 +397,16 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         tags = validated_data.pop("tags", None)
         if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
+            #OPOMBA: set() primerja z obstoječimi tag-i in izbriše/doda samo razliko
+            instance.tags.set(self._get_or_create_related(Tag, tags))
 
         ingredients = validated_data.pop("ingredients", None)
         if ingredients is not None:
             #OPOMBA: Tole se izvede samo, če smo dobili "ingredients" med parametri.
             #V nasprotnem primeru smo nastavili vrednost na None.
             #Dopuščamo da dobimo prazen seznam in na osnovi tega "pobrišemo" ingredients z recepta.
-            instance.ingredients.clear() #Zrišemo obstoječe
-            self._get_or_create_ingredients(ingredients, instance) #Nastavimo nove
+            #Nastavimo nove - odstranimo in dodamo samo sestavine, ki so se spremenile
+            instance.ingredients.set(self._get_or_create_related(Ingredient, ingredients))
 
         #Vse preostale podatke apliciramo na recept
         for attr, value in validated_data.items():
@@ -142,6 +425,130 @@ class RecipeDetailSerializer(RecipeSerializer):
         fields = RecipeSerializer.Meta.fields + ['description', 'image']
 
 
+class RecipeSearchSerializer(RecipeSerializer):
+    """Serializer for recipe full-text search results."""
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True) #Označeni zadetki (<mark>...</mark>)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ['rank', 'snippet']
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    """Validate the range filters and ordering of the recipe list."""
+    #Vsako sortiranje ima index (user, <stolpec>, id) - keyset paginacija doda id
+    ORDERING_CHOICES = [
+        "price", "-price", "time_minutes", "-time_minutes", "title", "-title", "id", "-id",
+    ]
+
+    price_min = serializers.DecimalField(max_digits=None, decimal_places=None, required=False)
+    price_max = serializers.DecimalField(max_digits=None, decimal_places=None, required=False)
+    time_max = serializers.IntegerField(min_value=0, required=False)
+    ordering = serializers.ChoiceField(choices=ORDERING_CHOICES, required=False)
+
+
+class PantrySerializer(serializers.Serializer):
+    """Ingredients the user has, for finding recipes they can cook."""
+    #OPOMBA: ingredient_ids je int4[] (intarray) - večje vrednosti bi bila napaka v bazi (500)
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=2**31 - 1), allow_empty=False,
+    )
+    max_missing = serializers.IntegerField(
+        min_value=0, max_value=settings.PANTRY_MAX_MISSING, default=0,
+    )
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.PANTRY_MAX_RESULTS, default=100,
+    )
+
+
+class RecipePantrySerializer(RecipeSerializer):
+    """Recipe with the number of ingredients missing from the pantry."""
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ['missing']
+
+
+class RandomSampleSerializer(serializers.Serializer):
+    """Parameters of the random recipes query."""
+    count = serializers.IntegerField(
+        min_value=1, max_value=settings.RECIPE_RANDOM_MAX_COUNT, default=1,
+    )
+
+
+class SimilarSerializer(serializers.Serializer):
+    """Parameters of the similar recipes query."""
+    metric = serializers.ChoiceField(choices=similarity.METRICS, default="jaccard")
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.RECIPE_SIMILARITY_MAX_RESULTS, default=10,
+    )
+
+
+class RecipeSimilarSerializer(RecipeSerializer):
+    """Recipe with its similarity to the requested recipe."""
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ['similarity']
+
+
+class DuplicateRecipeSerializer(serializers.Serializer):
+    """Recipe in a group of near-duplicates."""
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+
+
+class DuplicateClusterSerializer(serializers.Serializer):
+    """Recipes with (nearly) the same title and ingredients."""
+    recipes = DuplicateRecipeSerializer(many=True)
+
+
+class FacetSerializer(serializers.Serializer):
+    """Number of filtered recipes with a tag or ingredient."""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class RecipeFacetsSerializer(serializers.Serializer):
+    """Facet counts for the recipe filter (most used first)."""
+    tags = FacetSerializer(many=True)
+    ingredients = FacetSerializer(many=True)
+
+
+class RecipeImageField(serializers.ImageField):
+    """Image field that checks the byte and pixel budgets before verifying the image."""
+
+    default_error_messages = {
+        "max_bytes": "Image is larger than {max_bytes} bytes.",
+        "max_pixels": "Image has more than {max_pixels} pixels.",
+    }
+
+    def to_internal_value(self, data):
+        file_object = serializers.FileField.to_internal_value(self, data)
+        if file_object.size > settings.RECIPE_IMAGE_MAX_BYTES:
+            self.fail("max_bytes", max_bytes=settings.RECIPE_IMAGE_MAX_BYTES)
+
+        #OPOMBA: Image.open prebere samo glavo (format in dimenzije) - pikslov ne dekodira,
+        #zato "decompression bomb" zavrnemo, preden zasede pomnilnik
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                with Image.open(file_object) as image:
+                    pixels = image.width * image.height
+        except Image.DecompressionBombError:
+            pixels = None
+        except Exception:
+            self.fail("invalid_image")
+        finally:
+            file_object.seek(0)
+        if pixels is None or pixels > settings.RECIPE_IMAGE_MAX_PIXELS:
+            self.fail("max_pixels", max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS)
+
+        # Preverjanje glave/strukture slike (Image.verify), spet brez dekodiranja
+        return super().to_internal_value(file_object)
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipes."""
 
@@ -159,9 +566,11 @@ class RecipeImageSerializer(serializers.ModelSerializer):
     We want to have a specific separate API just for handling the image upload to make our API data structures
     clean and easy to use and understand.
     """
+    image = RecipeImageField(required=True)
+    image_derivatives = ImageDerivativesField()
+
     class Meta:
         model = Recipe
-        fields = ["id", "image"]
+        fields = ["id", "image", "image_derivatives"]
         read_only_fields = ["id"]
-        extra_kwargs = {"image": {"required": "True"}}
 
@@ -0,0 +1,66 @@
+"""
+Signal handlers for recipe models.
+"""
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Recipe, Tag, Ingredient
+from recipe import cache
+
+
+# Ime M2M polja na receptu za posamezno "through" tabelo
+M2M_FIELDS = {
+    Recipe.tags.through: "tags",
+    Recipe.ingredients.through: "ingredients",
+}
+
+
+def touch_recipes(**filters):
+    """Mark recipes as modified (their ETag changes)."""
+    Recipe.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """Invalidate cached responses when a recipe, tag or ingredient changes."""
+    cache.bump_version(instance.user_id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_using(sender, instance, created=False, **kwargs):
+    """Recipes embed tag/ingredient names, so renames and deletes modify them."""
+    if not created:
+        field = "tags" if sender is Tag else "ingredients"
+        touch_recipes(**{field: instance})
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate caches and touch recipes when their tags/ingredients change."""
+    if not reverse:
+        # instance je recept
+        if action in ("post_add", "post_remove", "post_clear"):
+            touch_recipes(pk=instance.pk)
+    elif action in ("post_add", "post_remove"):
+        # instance je tag/sestavina, pk_set so ID-ji receptov
+        touch_recipes(pk__in=pk_set)
+    elif action == "pre_clear":
+        touch_recipes(**{M2M_FIELDS[sender]: instance})
+
+    if action in ("post_add", "post_remove", "post_clear"):
+        cache.bump_version(instance.user_id)
@@ -0,0 +1,334 @@
+"""
+Similar-recipe index (Jaccard / cosine over tag and ingredient sets).
+
+Every recipe is a sparse binary vector of its tags and ingredients. A
+segment stores these vectors twice: by recipe (CSR) and by feature
+(inverted index). The overlap of one recipe with all others is then one
+np.bincount over the postings of its features - the sparse
+row-times-matrix product, without any per-pair Python code.
+
+The index of a user is built once and persisted as .npz (see the
+build_similarity_index command). After that it is updated incrementally:
+recipes whose updated_at changed (signals.py touches recipes when their
+tags or ingredients change) go to a small pending segment that masks
+their old rows. When the pending segment grows over
+RECIPE_SIMILARITY_MAX_PENDING recipes, both are merged and saved again.
+
+Changed recipes are found by transaction id, not by time (Recipe.change_txid,
+migration 0019). Before every read the index stores the oldest transaction
+still running (the snapshot xmin): everything older has finished and was
+read. The next refresh reads recipes changed by that transaction or newer,
+so a transaction that commits late is never missed.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from core.models import Recipe
+
+
+METRICS = ("jaccard", "cosine")
+
+
+def _timestamp(value):
+    """Return updated_at as integer microseconds."""
+    return round(value.timestamp() * 1_000_000)
+
+
+def _ids(values):
+    return np.fromiter(values, dtype=np.int64)
+
+
+def snapshot_horizon():
+    """Return the oldest transaction id still running (older ones have finished)."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        return cursor.fetchone()[0]
+
+
+class Segment:
+    """Immutable sparse recipe x feature matrix with an inverted index.
+
+    Tags and ingredients share one feature space: 2 * id for a tag and
+    2 * id + 1 for an ingredient. `horizon` is the snapshot xmin
+    (snapshot_horizon()) taken before its recipes were read.
+    """
+
+    def __init__(self, recipe_ids, updated, entry_rows, features, horizon=0):
+        # recipe_ids so urejeni, vnosi (entry_rows, features) pa po vrsticah
+        self.recipe_ids = recipe_ids
+        self.horizon = int(horizon)
+        self.updated = updated
+        self.entry_rows = entry_rows
+        self.features = features
+        self.indptr = np.searchsorted(entry_rows, np.arange(len(recipe_ids) + 1))
+        self.sizes = np.diff(self.indptr)
+
+        order = np.argsort(features, kind="stable")
+        self.posting_features = features[order]
+        self.posting_rows = entry_rows[order]
+
+    @classmethod
+    def from_arrays(cls, recipe_ids, updated, entry_recipes, features, horizon=0):
+        """Build a segment from unsorted recipes and (recipe id, feature) entries."""
+        order = np.argsort(recipe_ids)
+        recipe_ids = recipe_ids[order]
+        entries = np.lexsort((features, entry_recipes))
+        return cls(
+            recipe_ids,
+            updated[order],
+            np.searchsorted(recipe_ids, entry_recipes[entries]),
+            features[entries],
+            horizon,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["recipe_ids"], data["updated"], data["entry_rows"], data["features"],
+                data["horizon"],
+            )
+
+    def save(self, path):
+        """Atomically write the segment to `path`."""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer, recipe_ids=self.recipe_ids, updated=self.updated,
+            entry_rows=self.entry_rows, features=self.features, horizon=self.horizon,
+        )
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    @property
+    def nbytes(self):
+        """Return the memory taken by the arrays of the segment."""
+        return sum(
+            array.nbytes for array in (
+                self.recipe_ids, self.updated, self.entry_rows, self.features,
+                self.indptr, self.sizes, self.posting_features, self.posting_rows,
+            )
+        )
+
+    def rows_of(self, recipe_ids):
+        """Return the row of each recipe id (-1 where missing)."""
+        if not len(self.recipe_ids):
+            return np.full(len(recipe_ids), -1)
+        rows = np.searchsorted(self.recipe_ids, recipe_ids).clip(max=len(self.recipe_ids) - 1)
+        return np.where(self.recipe_ids[rows] == recipe_ids, rows, -1)
+
+    def row_features(self, row):
+        return self.features[self.indptr[row]:self.indptr[row + 1]]
+
+    def overlap(self, features):
+        """Return the number of `features` every row has (one bincount)."""
+        start = np.searchsorted(self.posting_features, features, side="left")
+        lengths = np.searchsorted(self.posting_features, features, side="right") - start
+        # Indeksi vseh posting-ov iskanih značilk (brez zanke po značilkah)
+        positions = np.arange(lengths.sum()) + np.repeat(start - np.cumsum(lengths) + lengths, lengths)
+        return np.bincount(self.posting_rows[positions], minlength=len(self.recipe_ids))
+
+    def merge(self, other, removed=()):
+        """Return one segment with the rows of both; rows of `other` win."""
+        keep = ~np.isin(self.recipe_ids, np.concatenate([other.recipe_ids, _ids(removed)]))
+        keep_entries = keep[self.entry_rows]
+        return Segment.from_arrays(
+            np.concatenate([self.recipe_ids[keep], other.recipe_ids]),
+            np.concatenate([self.updated[keep], other.updated]),
+            np.concatenate([
+                self.recipe_ids[self.entry_rows[keep_entries]],
+                other.recipe_ids[other.entry_rows],
+            ]),
+            np.concatenate([self.features[keep_entries], other.features]),
+            max(self.horizon, other.horizon),
+        )
+
+
+def load_segment(user_id, recipe_ids=None, horizon=0):
+    """Read recipes of the user (all or `recipe_ids`) from the database."""
+    recipes = Recipe.objects.filter(user_id=user_id)
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=list(recipe_ids))
+    #OPOMBA: Recepte preberemo pred tag-i - če se tag-i vmes spremenijo, ima
+    #recept v indeksu star updated_at in ga naslednji refresh() prebere znova
+    rows = list(recipes.values_list("id", "updated_at", "ingredient_ids"))
+    tag_rows = list(
+        Recipe.tags.through.objects.filter(recipe__in=recipes)
+        .values_list("recipe_id", "tag_id")
+    )
+
+    ingredient_ids = [row[2] for row in rows]
+    return Segment.from_arrays(
+        _ids(row[0] for row in rows),
+        _ids(_timestamp(row[1]) for row in rows),
+        np.concatenate([
+            _ids(row[0] for row in tag_rows),
+            np.repeat(_ids(row[0] for row in rows), [len(ids) for ids in ingredient_ids]),
+        ]),
+        np.concatenate([
+            2 * _ids(row[1] for row in tag_rows),
+            2 * _ids(i for ids in ingredient_ids for i in ids) + 1,
+        ]),
+        horizon,
+    )
+
+
+EMPTY = Segment.from_arrays(_ids([]), _ids([]), _ids([]), _ids([]))
+
+
+class SimilarityIndex:
+    """Similarity index of one user: a persisted segment plus pending changes."""
+
+    def __init__(self, user_id, segment):
+        self.user_id = user_id
+        self.segment = segment
+        self.pending = EMPTY
+        # Izbrisani recepti (odkrijemo jih, ko jih ni več v bazi)
+        self.removed = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, user_id):
+        """Build the index of the user from the database."""
+        # Horizont preberemo pred recepti
+        return cls(user_id, load_segment(user_id, horizon=snapshot_horizon()))
+
+    @classmethod
+    def load(cls, user_id):
+        """Load the saved index of the user, or build and save it."""
+        try:
+            return cls(user_id, Segment.load(index_path(user_id)))
+        except (FileNotFoundError, KeyError):
+            # KeyError: indeks iz starejše verzije (brez horizonta) zgradimo znova
+            index = cls.build(user_id)
+            index.save()
+            return index
+
+    def save(self):
+        os.makedirs(settings.RECIPE_SIMILARITY_DIR, exist_ok=True)
+        self.segment.save(index_path(self.user_id))
+
+    def refresh(self):
+        """Apply recipes changed since the index was last updated."""
+        with self.lock:
+            since = max(self.segment.horizon, self.pending.horizon)
+            horizon = snapshot_horizon()
+            #OPOMBA: Transakcija lahko zapiše več sprememb istega recepta (in vse imajo isti
+            #txid) - ali se je recept spremenil, zato še vedno odloča updated_at
+            recipes = Recipe.objects.filter(user_id=self.user_id, change_txid__gte=since)
+            rows = list(recipes.values_list("id", "updated_at"))
+            if not rows:
+                return
+
+            recipe_ids = _ids(row[0] for row in rows)
+            updated = _ids(_timestamp(row[1]) for row in rows)
+            changed = recipe_ids[updated != self._updated(recipe_ids)]
+            if len(changed):
+                self._apply(load_segment(self.user_id, changed.tolist(), horizon))
+
+    @property
+    def nbytes(self):
+        """Return the memory taken by the index."""
+        return self.segment.nbytes + self.pending.nbytes
+
+    def discard(self, recipe_ids):
+        """Drop deleted recipes from the results."""
+        with self.lock:
+            self.removed.update(recipe_ids)
+
+    def _updated(self, recipe_ids):
+        """Return the updated_at the index has for each recipe (0 if none)."""
+        updated = np.zeros(len(recipe_ids), dtype=np.int64)
+        for segment in (self.segment, self.pending):
+            rows = segment.rows_of(recipe_ids)
+            found = rows >= 0
+            updated[found] = segment.updated[rows[found]]
+        return updated
+
+    def _apply(self, changes):
+        self.pending = self.pending.merge(changes)
+        if len(self.pending.recipe_ids) > settings.RECIPE_SIMILARITY_MAX_PENDING:
+            self.segment = self.segment.merge(self.pending, self.removed)
+            self.pending, self.removed = EMPTY, set()
+            self.save()
+
+    def similar(self, recipe_id, limit, metric="jaccard"):
+        """Return (recipe ids, scores) of the `limit` most similar recipes."""
+        with self.lock:
+            features = None
+            for segment in (self.pending, self.segment):
+                row = segment.rows_of(_ids([recipe_id]))[0]
+                if row >= 0:
+                    features = segment.row_features(row)
+                    break
+            if features is None or not len(features):
+                return _ids([]), np.empty(0)
+
+            # Stare vrstice spremenjenih (pending) in izbrisanih receptov ne štejejo
+            excluded = _ids([recipe_id, *self.removed])
+            masks = (np.concatenate([excluded, self.pending.recipe_ids]), excluded)
+            ids, scores = [], []
+            for segment, mask in zip((self.segment, self.pending), masks):
+                overlap = segment.overlap(features)
+                rows = np.flatnonzero(overlap)
+                rows = rows[~np.isin(segment.recipe_ids[rows], mask)]
+                ids.append(segment.recipe_ids[rows])
+                scores.append(_score(metric, overlap[rows], len(features), segment.sizes[rows]))
+
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        if len(ids) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            ids, scores = ids[top], scores[top]
+        # Najbolj podobni najprej, pri enaki podobnosti novejši recepti
+        order = np.lexsort((-ids, -scores))
+        return ids[order], scores[order]
+
+
+def _score(metric, overlap, size, sizes):
+    if metric == "cosine":
+        return overlap / np.sqrt(size * sizes)
+    return overlap / (size + sizes - overlap)
+
+
+def index_path(user_id):
+    return os.path.join(settings.RECIPE_SIMILARITY_DIR, f"user-{user_id}.npz")
+
+
+# Indeksi, naloženi v tem procesu (skupaj največ RECIPE_SIMILARITY_MAX_BYTES, LRU)
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(user_id):
+    """Return the up to date similarity index of the user."""
+    with _indexes_lock:
+        index = _indexes.pop(user_id, None)
+        if index is not None:
+            _indexes[user_id] = index
+    if index is None:
+        index = SimilarityIndex.load(user_id)
+        with _indexes_lock:
+            index = _indexes.setdefault(user_id, index)
+
+    index.refresh()
+    _evict()
+    return index
+
+
+def _evict():
+    """Drop least recently used indexes while they take more than RECIPE_SIMILARITY_MAX_BYTES."""
+    with _indexes_lock:
+        # Indeks se z refresh()/merge spreminja - velikost seštejemo vsakič znova
+        sizes = {user_id: index.nbytes for user_id, index in _indexes.items()}
+        total = sum(sizes.values())
+        # Zadnjega (pravkar uporabljenega) obdržimo, tudi če je sam večji od meje
+        while total > settings.RECIPE_SIMILARITY_MAX_BYTES and len(_indexes) > 1:
+            user_id, _ = _indexes.popitem(last=False)
+            total -= sizes[user_id]
@@ -18,6 +18,7 @@ from core.models import (
 from recipe.serializers import IngredientSerializer
 
 INGREDIENTS_URL = reverse("recipe:ingredient-list")
+AUTOCOMPLETE_URL = reverse("recipe:ingredient-autocomplete")
 
 
 def create_user(email="user@example.com", password="test123"):
@@ -61,7 +62,7 @@ class PrivateIngredientsApiTests(TestCase):
         serializer = IngredientSerializer(ingredients, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data["results"], serializer.data)
 
     def test_ingredients_limited_user(self):
         """Test list of ingredients is limited to authenticated user."""
@@ -77,9 +78,9 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]["name"], ingredient.name)
-        self.assertEqual(res.data[0]["id"], ingredient.id)
+        self.assertEqual(len(res.data["results"]), 1)
+        self.assertEqual(res.data["results"][0]["name"], ingredient.name)
+        self.assertEqual(res.data["results"][0]["id"], ingredient.id)
 
     def test_update_ingredient(self):
         """Test updating and ingredient."""
@@ -121,8 +122,8 @@ class PrivateIngredientsApiTests(TestCase):
         s1 = IngredientSerializer(in1)
         s2 = IngredientSerializer(in2)
 
-        self.assertIn(s1.data, res.data)
-        self.assertNotIn(s2.data, res.data)
+        self.assertIn(s1.data, res.data["results"])
+        self.assertNotIn(s2.data, res.data["results"])
 
     def test_filtered_ingredients_unique(self):
         """Test filtered ingredients returns a unique list (distinct)."""
@@ -149,5 +150,17 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL, {"assigned_only": 1})
 
         # Mora vrniti ingredients samo 1x
-        self.assertEqual(len(res.data),1)
+        self.assertEqual(len(res.data["results"]),1)
+
+    def test_autocomplete_ingredients(self):
+        """Test autocomplete of ingredient names."""
+        ingredient = Ingredient.objects.create(user=self.user, name="Tomato")
+        Ingredient.objects.create(user=self.user, name="Potato")
+        Ingredient.objects.create(user=self.user, name="Salt")
+
+        res = self.client.get(AUTOCOMPLETE_URL, {"q": "tomatoe"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0], IngredientSerializer(ingredient).data)
+        self.assertNotIn("Salt", [i["name"] for i in res.data])
 
@@ -6,21 +6,33 @@ Tests for recipe APIs.
 # import imports an entire code library.
 # from import imports a specific member or members of the library.
 
+from datetime import timedelta
 from decimal import Decimal
+import hashlib
+from io import BytesIO
 import tempfile
 import os
+from unittest.mock import patch
 
 from PIL import Image #Pillow image library
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
 from core.models import (
     Recipe,
+    RecipeDuplicates,
     Tag,
     Ingredient,
 )
@@ -28,10 +40,18 @@ from core.models import (
 from recipe.serializers import (
     RecipeSerializer,
     RecipeDetailSerializer,
+    RecipeSearchSerializer,
 )
+from recipe import dedup, images, similarity, uploads
+from recipe.views import ORDERED_RELATIONS
 
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BULK_URL = reverse('recipe:recipe-bulk')
+FACETS_URL = reverse('recipe:recipe-facets')
+PANTRY_URL = reverse('recipe:recipe-pantry')
+DUPLICATES_URL = reverse('recipe:recipe-duplicates')
+RANDOM_URL = reverse('recipe:recipe-random')
 
 
 def detail_url(recipe_id):
@@ -41,6 +61,18 @@ def detail_url(recipe_id):
 
 #region HELPER FUNCTIONS
 
+def similar_url(recipe_id):
+    """Create and return a similar recipes URL."""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def create_image_bytes(size, image_format):
+    """Return an encoded test image."""
+    buffer = BytesIO()
+    Image.new("RGB", size, "red").save(buffer, image_format)
+    return buffer.getvalue()
+
+
 def image_upload_url(recipe_id):
     """Create and return an image upload URL"""
     # This is a helper function that allows us to generate the URL to the upload image endpoint.
@@ -128,7 +160,7 @@ class PrivateRecipeApiTests(TestCase):
         serializer = RecipeSerializer(recipes, many=True) #Serializer lahko sprejme/vrne 1 podatek ali VEČ podatkov
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data) #Data dictionary of the objects passed through th serializer
+        self.assertEqual(res.data['results'], serializer.data) #Data dictionary of the objects passed through th serializer
 
     def test_recipe_list_limited_to_user(self):
         """Test list of recipes is limited to authenticated user."""
@@ -158,7 +190,232 @@ class PrivateRecipeApiTests(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data) #Data dictionary of the objects passed through th serializer
+        self.assertEqual(res.data['results'], serializer.data) #Data dictionary of the objects passed through th serializer
+
+    def _create_recipes_with_relations(self, count):
+        """Create recipes, each with its own tag and ingredient."""
+        for i in range(count):
+            recipe = create_recipe(user=self.user, title=f"Recipe {i}")
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f"Tag {recipe.id}"))
+            recipe.ingredients.add(
+                Ingredient.objects.create(user=self.user, name=f"Ingredient {recipe.id}")
+            )
+
+    def test_list_query_count_constant(self):
+        """Test the number of list queries does not grow with the number of recipes."""
+        self._create_recipes_with_relations(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(RECIPES_URL)
+
+        self._create_recipes_with_relations(10)
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(few), len(many))
+
+    def test_retrieve_query_count_constant(self):
+        """Test retrieving a recipe does not query per tag or ingredient."""
+        recipe = create_recipe(user=self.user)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(detail_url(recipe.id))
+
+        for i in range(5):
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f"Tag {i}"))
+            recipe.ingredients.add(
+                Ingredient.objects.create(user=self.user, name=f"Ingredient {i}")
+            )
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(few), len(many))
+
+    def test_list_served_from_cache(self):
+        """Test a repeated list request is served from the cache."""
+        create_recipe(user=self.user)
+
+        res1 = self.client.get(RECIPES_URL)
+        with CaptureQueriesContext(connection) as queries:
+            res2 = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res1['X-Cache'], 'MISS')
+        self.assertEqual(res2['X-Cache'], 'HIT')
+        self.assertEqual(res1.data, res2.data)
+        self.assertEqual(len(queries), 1) # Samo poizvedba za ETag
+
+    def test_list_cache_invalidated_on_change(self):
+        """Test changes to recipes and their tags invalidate the cached list."""
+        recipe = create_recipe(user=self.user)
+        self.client.get(RECIPES_URL)
+
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        recipe.tags.add(tag)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['results'][0]['tags'][0]['name'], 'Dinner')
+
+        tag.name = 'Supper'
+        tag.save()
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.data['results'][0]['tags'][0]['name'], 'Supper')
+
+    def test_list_cache_per_user(self):
+        """Test another user's changes do not invalidate this user's cache."""
+        create_recipe(user=self.user)
+        self.client.get(RECIPES_URL)
+
+        other_user = create_user(email='other@example.com', password='test123')
+        create_recipe(user=other_user)
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res['X-Cache'], 'HIT')
+
+    def test_list_not_modified(self):
+        """Test polling an unchanged list returns 304 with one query."""
+        create_recipe(user=self.user)
+        res = self.client.get(RECIPES_URL)
+        etag = res['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(len(queries), 1)
+
+    def test_list_etag_changes(self):
+        """Test the list ETag changes with recipes and query parameters."""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        self.assertNotEqual(self.client.get(RECIPES_URL, {'page_size': 1})['ETag'], etag)
+
+        recipe.title = 'New title'
+        recipe.save()
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_detail_not_modified(self):
+        """Test conditional GET of a recipe detail."""
+        recipe = create_recipe(user=self.user)
+        url = detail_url(recipe.id)
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=f'W/{etag}')
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        recipe.tags.add(tag)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        etag = res['ETag']
+        tag.name = 'Supper'
+        tag.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'][0]['name'], 'Supper')
+
+    def test_list_paginated_with_cursor(self):
+        """Test walking the recipe list forwards and backwards with cursors."""
+        recipes = [create_recipe(user=self.user) for i in range(5)]
+        expected = [recipe.id for recipe in reversed(recipes)]
+
+        ids = []
+        url = f'{RECIPES_URL}?page_size=2'
+        pages = []
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            ids += [recipe['id'] for recipe in res.data['results']]
+            pages.append(res.data)
+            url = res.data['next']
+
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        res = self.client.get(pages[-1]['previous'])
+        self.assertEqual([recipe['id'] for recipe in res.data['results']], expected[2:4])
+
+    def test_list_invalid_cursor(self):
+        """Test an invalid cursor returns not found."""
+        create_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL, {'cursor': 'notacursor'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_fast_path_matches_serializer(self):
+        """Test serializing values() rows gives the same JSON as model instances."""
+        self._create_recipes_with_relations(3)
+        recipe = create_recipe(user=self.user, price=Decimal('7.5'), link='')
+        recipe.tags.add(*Tag.objects.order_by('-id'))
+        recipe.ingredients.add(*Ingredient.objects.order_by('-id'))
+        recipes = Recipe.objects.filter(user=self.user).order_by('-id').annotate(
+            rank=Value(0.25, output_field=FloatField()), snippet=Value('<mark>x</mark>'),
+        )
+
+        for serializer_class in (RecipeSerializer, RecipeSearchSerializer):
+            columns = [
+                name for name in serializer_class.Meta.fields
+                if name not in serializer_class.expandable_fields
+            ]
+            instances = list(recipes.prefetch_related(*ORDERED_RELATIONS))
+            rows = list(recipes.values(*columns))
+
+            self.assertEqual(
+                JSONRenderer().render(serializer_class(rows, many=True).data),
+                JSONRenderer().render(serializer_class(instances, many=True).data),
+            )
+
+    def test_list_sparse_fields(self):
+        """Test ?fields= returns only the selected fields and skips prefetches."""
+        self._create_recipes_with_relations(3)
+        with CaptureQueriesContext(connection) as full:
+            self.client.get(RECIPES_URL)
+
+        with CaptureQueriesContext(connection) as sparse:
+            res = self.client.get(f'{RECIPES_URL}?fields=title,price')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        for recipe in res.data['results']:
+            self.assertEqual(set(recipe), {'id', 'title', 'price'})
+        self.assertEqual(len(sparse), len(full) - 2) # Brez prefetch-a tag-ov in sestavin
+        self.assertNotIn('description', sparse.captured_queries[-1]['sql'])
+
+    def test_list_include_relations(self):
+        """Test ?include= embeds only the selected relations."""
+        self._create_recipes_with_relations(2)
+
+        res = self.client.get(f'{RECIPES_URL}?include=tags')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe = res.data['results'][0]
+        self.assertIn('title', recipe)
+        self.assertEqual(len(recipe['tags']), 1)
+        self.assertNotIn('ingredients', recipe)
+
+    def test_detail_sparse_fields(self):
+        """Test selecting fields of a recipe detail."""
+        recipe = create_recipe(user=self.user)
+
+        res = self.client.get(f'{detail_url(recipe.id)}?fields=description&include=ingredients')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data, {'id': recipe.id, 'description': recipe.description, 'ingredients': []}
+        )
+
+    def test_sparse_fields_unknown(self):
+        """Test unknown fields and relations return bad request."""
+        res = self.client.get(f'{RECIPES_URL}?fields=title,secret')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(f'{RECIPES_URL}?include=user')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 #endregion
 
 #region TEST: Recipe Details
@@ -421,6 +678,150 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(recipe.tags.count(), 0)
 
+    def test_update_tags_writes_only_difference(self):
+        """Test a one-tag PATCH deletes and inserts one through-table row."""
+        recipe = create_recipe(user=self.user)
+        tags = [Tag.objects.create(user=self.user, name=f'Tag {i}') for i in range(5)]
+        recipe.tags.add(*tags)
+        through = Recipe.tags.through._meta.db_table
+
+        def writes(names):
+            payload = {'tags': [{'name': name} for name in names]}
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.patch(detail_url(recipe.id), payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            sql = [query['sql'] for query in queries if f'"{through}"' in query['sql']]
+            return (
+                sum(statement.startswith('DELETE') for statement in sql),
+                sum(statement.startswith('INSERT') for statement in sql),
+            )
+
+        names = [tag.name for tag in tags]
+        self.assertEqual(writes(names[:4] + ['Extra']), (1, 1))
+        self.assertEqual(writes(names[:4] + ['Extra']), (0, 0))
+        self.assertEqual(
+            sorted(recipe.tags.values_list('name', flat=True)),
+            sorted(names[:4] + ['Extra']),
+        )
+
+    def test_bulk_create(self):
+        """Test creating a batch of recipes returns them in order."""
+        payload = [
+            {
+                'title': f'Recipe {i}',
+                'time_minutes': 10 + i,
+                'price': '2.50',
+                'tags': [{'name': 'Dinner'}, {'name': f'Tag {i}'}],
+                'ingredients': [{'name': 'Salt'}],
+            }
+            for i in range(3)
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['title'] for item in res.data], ['Recipe 0', 'Recipe 1', 'Recipe 2'])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(Tag.objects.filter(user=self.user, name='Dinner').count(), 1)
+        for item in res.data:
+            recipe = Recipe.objects.get(id=item['id'])
+            self.assertEqual(recipe.tags.count(), 2)
+            self.assertEqual(recipe.ingredients.get().name, 'Salt')
+        self.assertEqual(len(self.client.get(RECIPES_URL).data['results']), 3)
+
+    def test_bulk_create_query_count_constant(self):
+        """Test the number of queries does not grow with the batch size."""
+        def create(count):
+            payload = [
+                {
+                    'title': f'Recipe {i}', 'time_minutes': 5, 'price': '1.00',
+                    'tags': [{'name': f'Tag {i}'}], 'ingredients': [{'name': f'Ingredient {i}'}],
+                }
+                for i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(BULK_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(create(2), create(30))
+
+    def test_bulk_create_invalid_item(self):
+        """Test one invalid item rejects the batch with per-item errors."""
+        payload = [
+            {'title': 'Valid', 'time_minutes': 5, 'price': '1.00'},
+            {'title': 'Invalid', 'price': '1.00'},
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('time_minutes', res.data[1])
+        self.assertFalse(Recipe.objects.exists())
+
+    @override_settings(RECIPE_BULK_MAX_BATCH=2)
+    def test_bulk_max_batch(self):
+        """Test batches over the configured size are rejected."""
+        payload = [{'title': 'R', 'time_minutes': 5, 'price': '1.00'}] * 3
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_partial_update(self):
+        """Test partially updating a batch of recipes."""
+        recipe1 = create_recipe(user=self.user, title='One')
+        recipe2 = create_recipe(user=self.user, title='Two')
+        recipe2.tags.add(Tag.objects.create(user=self.user, name='Old'))
+        payload = [
+            {'id': recipe2.id, 'tags': [{'name': 'New'}]},
+            {'id': recipe1.id, 'title': 'First', 'price': '9.99'},
+        ]
+
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data], [recipe2.id, recipe1.id])
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe1.title, 'First')
+        self.assertEqual(recipe1.price, Decimal('9.99'))
+        self.assertEqual(recipe2.title, 'Two')
+        self.assertEqual([tag.name for tag in recipe2.tags.all()], ['New'])
+
+    def test_bulk_update_other_users_recipe(self):
+        """Test a batch with another user's recipe is rejected."""
+        recipe = create_recipe(user=self.user, title='Mine')
+        other = create_recipe(user=create_user(email='other@example.com'), title='Theirs')
+        payload = [
+            {'id': recipe.id, 'title': 'Changed'},
+            {'id': other.id, 'title': 'Changed'},
+        ]
+
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[1], {'id': ['Not found.']})
+        other.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual(other.title, 'Theirs')
+        self.assertEqual(recipe.title, 'Mine')
+
+    def test_bulk_delete(self):
+        """Test deleting a batch of recipes only deletes the user's own."""
+        recipes = [create_recipe(user=self.user) for i in range(2)]
+        other = create_recipe(user=create_user(email='other@example.com'))
+        ids = [recipes[0].id, other.id, recipes[1].id]
+
+        res = self.client.delete(BULK_URL, ids, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['deleted'] for item in res.data], [True, False, True])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+        self.assertTrue(Recipe.objects.filter(id=other.id).exists())
+
     def test_create_recipe_with_new_ingredients(self):
         """Test creating a recipe with new ingredients."""
         payload = {
@@ -444,6 +845,27 @@ class PrivateRecipeApiTests(TestCase):
             ).exists
             self.assertTrue(exists)
 
+    def test_create_recipe_query_count_constant(self):
+        """Test creating a recipe does not query per tag or ingredient."""
+        def create(count):
+            payload = {
+                "title": "Stew",
+                "time_minutes": 60,
+                "price": Decimal("4.30"),
+                "tags": [{"name": f"Tag {i}"} for i in range(count)],
+                "ingredients": [{"name": f"Ingredient {i}"} for i in range(count)],
+            }
+            Ingredient.objects.create(user=self.user, name="Ingredient 0")
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(RECIPES_URL, payload, format="json")
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            Recipe.objects.all().delete()
+            Tag.objects.all().delete()
+            Ingredient.objects.all().delete()
+            return len(queries)
+
+        self.assertEqual(create(2), create(40))
+
     def test_create_recipe_with_existing_ingredient(self):
         """Test creating a new recipe with existing ingredient."""
         #ingredient = Ingredient.objects.create(user = self.user, name = "Lemon")
@@ -531,9 +953,383 @@ class PrivateRecipeApiTests(TestCase):
         s1 = RecipeSerializer(r1)
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data['results'])
+        self.assertIn(s2.data, res.data['results'])
+        self.assertNotIn(s3.data, res.data['results'])
+
+    def test_filter_by_tags_no_duplicates(self):
+        """Test a recipe matching several filter tags is returned once."""
+        recipe = create_recipe(user=self.user)
+        tag1 = Tag.objects.create(user=self.user, name="Vegan")
+        tag2 = Tag.objects.create(user=self.user, name="Dinner")
+        recipe.tags.add(tag1, tag2)
+
+        res = self.client.get(RECIPES_URL, {"tags": f"{tag1.id},{tag2.id}"})
+
+        self.assertEqual([r["id"] for r in res.data['results']], [recipe.id])
+
+    def test_filter_by_tags_match_all(self):
+        """Test match=all returns only recipes with every given tag."""
+        tag1 = Tag.objects.create(user=self.user, name="Vegan")
+        tag2 = Tag.objects.create(user=self.user, name="Dinner")
+        r1 = create_recipe(user=self.user, title="Lentil Curry")
+        r1.tags.add(tag1, tag2)
+        r2 = create_recipe(user=self.user, title="Green Salad")
+        r2.tags.add(tag1)
+
+        params = {"tags": f"{tag1.id},{tag2.id}", "match": "all"}
+        res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["id"] for r in res.data['results']], [r1.id])
+
+    def test_filter_by_ingredients_match_all(self):
+        """Test match=all applies to ingredients as well."""
+        in1 = Ingredient.objects.create(user=self.user, name='Chicken')
+        in2 = Ingredient.objects.create(user=self.user, name='Rice')
+        r1 = create_recipe(user=self.user, title='Chicken Rice')
+        r1.ingredients.add(in1, in2)
+        r2 = create_recipe(user=self.user, title='Roast Chicken')
+        r2.ingredients.add(in1)
+
+        params = {'ingredients': f'{in1.id},{in2.id}', 'match': 'all'}
+        res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual([r['id'] for r in res.data['results']], [r1.id])
+
+    def test_filter_invalid_match(self):
+        """Test an unknown match mode returns a bad request."""
+        res = self.client.get(RECIPES_URL, {"match": "some"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_recipes(self):
+        """Test full-text search returns ranked matches with a snippet."""
+        r1 = create_recipe(
+            user=self.user, title='Lemon Tart', description='Sweet pastry.',
+        )
+        r2 = create_recipe(
+            user=self.user, title='Fish Soup', description='Finish with a squeeze of lemon.',
+        )
+        create_recipe(user=self.user, title='Beef Stew', description='Slow cooked.')
+        other_user = create_user(email='other@example.com', password='test123')
+        create_recipe(user=other_user, title='Lemon Cake')
+
+        res = self.client.get(RECIPES_URL, {'q': 'lemons'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = res.data['results']
+        self.assertEqual([r['id'] for r in results], [r1.id, r2.id])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+        self.assertIn('<mark>Lemon</mark>', results[0]['snippet'])
+
+    def test_search_recipes_paginated(self):
+        """Test paging through search results keeps the rank order."""
+        for i in range(3):
+            create_recipe(user=self.user, title=f'Tomato Soup {i}')
+        create_recipe(user=self.user, title='Tomato', description='Tomato tomato.')
+
+        res = self.client.get(RECIPES_URL, {'q': 'tomato', 'page_size': 1})
+        ids = [r['id'] for r in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids += [r['id'] for r in res.data['results']]
+
+        expected = self.client.get(RECIPES_URL, {'q': 'tomato'}).data['results']
+        self.assertEqual(ids, [r['id'] for r in expected])
+        self.assertEqual(len(ids), 4)
+
+    def test_filter_by_price_and_time(self):
+        """Test filtering recipes by price range and maximum cooking time."""
+        cheap = create_recipe(user=self.user, price=Decimal('2.00'), time_minutes=10)
+        mid = create_recipe(user=self.user, price=Decimal('5.50'), time_minutes=45)
+        create_recipe(user=self.user, price=Decimal('12.00'), time_minutes=15)
+
+        res = self.client.get(f'{RECIPES_URL}?price_min=2&price_max=5.50')
+        self.assertEqual({r['id'] for r in res.data['results']}, {cheap.id, mid.id})
+
+        res = self.client.get(f'{RECIPES_URL}?price_max=10&time_max=30')
+        self.assertEqual([r['id'] for r in res.data['results']], [cheap.id])
+
+    def test_filter_invalid_range(self):
+        """Test invalid range filters and orderings return bad request."""
+        for query in ('price_min=cheap', 'time_max=-1', 'price_max=NaN', 'ordering=user'):
+            res = self.client.get(f'{RECIPES_URL}?{query}')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_ordering_with_pagination(self):
+        """Test every ordering walks all pages in order, including ties."""
+        prices = ['3.00', '1.00', '3.00', '2.00', '3.00', '1.00']
+        for i, price in enumerate(prices):
+            create_recipe(
+                user=self.user, price=Decimal(price),
+                time_minutes=(i * 7) % 4, title=f'Recipe {i % 3}',
+            )
+
+        for ordering in ('price', '-price', 'time_minutes', '-time_minutes', 'title', '-title', 'id'):
+            field = ordering.lstrip('-')
+            recipes = Recipe.objects.filter(user=self.user)
+            if ordering.startswith('-'):
+                expected = list(recipes.order_by(ordering, '-id').values_list('id', flat=True))
+            else:
+                expected = list(recipes.order_by(ordering, 'id').values_list('id', flat=True))
+
+            ids = []
+            url = f'{RECIPES_URL}?ordering={ordering}&page_size=4&fields={field}'
+            while url:
+                res = self.client.get(url)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                ids += [recipe['id'] for recipe in res.data['results']]
+                url = res.data['next']
+
+            self.assertEqual(ids, expected, ordering)
+
+    def _pantry_recipes(self):
+        """Create ingredients and recipes for the pantry tests."""
+        eggs, flour, milk, salt = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Eggs', 'Flour', 'Milk', 'Salt')
+        ]
+        pancakes = create_recipe(user=self.user, title='Pancakes')
+        pancakes.ingredients.add(eggs, flour, milk)
+        omelette = create_recipe(user=self.user, title='Omelette')
+        omelette.ingredients.add(eggs, salt)
+        bread = create_recipe(user=self.user, title='Bread')
+        bread.ingredients.add(flour, salt)
+        create_recipe(user=self.user, title='Water')
+        return (eggs, flour, milk, salt), (pancakes, omelette, bread)
+
+    def test_pantry_fully_covered(self):
+        """Test finding recipes whose ingredients are all in the pantry."""
+        (eggs, flour, milk, salt), (pancakes, omelette, bread) = self._pantry_recipes()
+        other = create_recipe(user=create_user(email='other@example.com'))
+        other.ingredients.add(eggs)
+
+        res = self.client.post(
+            PANTRY_URL, {'ingredients': [eggs.id, flour.id, milk.id]}, format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([(r['title'], r['missing']) for r in res.data], [('Pancakes', 0)])
+
+    def test_pantry_nearly_covered(self):
+        """Test near matches are ranked by the number of missing ingredients."""
+        (eggs, flour, milk, salt), (pancakes, omelette, bread) = self._pantry_recipes()
+        omelette.ingredients.remove(salt)
+        omelette.ingredients.add(milk, flour)
+
+        res = self.client.post(
+            PANTRY_URL, {'ingredients': [eggs.id, salt.id], 'max_missing': 2}, format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(r['id'], r['missing']) for r in res.data],
+            [(bread.id, 1), (omelette.id, 2), (pancakes.id, 2)],
+        )
+
+    def test_pantry_invalid(self):
+        """Test an empty pantry or too many missing ingredients are rejected."""
+        res = self.client.post(PANTRY_URL, {'ingredients': []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(PANTRY_URL, {'ingredients': [1], 'max_missing': 99}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pantry_ingredient_id_out_of_range(self):
+        """Test ingredient IDs outside the int4 range are rejected, not a server error."""
+        for ingredient_id in (0, -5, 2**31):
+            res = self.client.post(PANTRY_URL, {'ingredients': [ingredient_id]}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('ingredients', res.data)
+
+    @patch('recipe.dedup.executor.submit')
+    def test_duplicates(self, patched_submit):
+        """Test recipes with nearly the same title and ingredients are grouped in the background."""
+        patched_submit.side_effect = lambda task, *args: task(*args)
+        ingredients = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Pasta', 'Eggs', 'Bacon', 'Pecorino', 'Pepper')
+        ]
+        titles = ('Pasta Carbonara', 'pasta carbonara!', 'Pasta Carbonara (2)', 'Pasta')
+        recipes = []
+        for title in titles:
+            recipe = create_recipe(user=self.user, title=title)
+            recipe.ingredients.add(*ingredients[:4 if title != 'Pasta' else 1])
+            recipes.append(recipe)
+        recipes[2].ingredients.add(ingredients[4])
+        other = create_recipe(user=create_user(email='other@example.com'), title='Pasta Carbonara')
+        other.ingredients.add(*ingredients[:4])
+
+        # Task zapre povezavo na bazo - v testu teče v isti niti kot test
+        with patch.object(connection, 'close'), \
+                patch('recipe.dedup.clusters', wraps=dedup.clusters) as patched_clusters:
+            with self.captureOnCommitCallbacks(execute=True):
+                first_res = self.client.get(DUPLICATES_URL)
+                # Request ne računa - skupine izračuna task po odgovoru
+                patched_clusters.assert_not_called()
+            res = self.client.get(DUPLICATES_URL)
+            patched_clusters.assert_called_once_with(self.user.id)
+
+        self.assertEqual(first_res.status_code, status.HTTP_200_OK)
+        self.assertEqual(first_res.data, [])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{
+            'recipes': [{'id': r.id, 'title': r.title} for r in recipes[:3]],
+        }])
+
+    def test_duplicates_after_delete(self):
+        """Test stored groups are recomputed when one of their recipes is deleted."""
+        ingredient = Ingredient.objects.create(user=self.user, name='Pasta')
+        recipes = [create_recipe(user=self.user, title='Pasta Carbonara') for _ in range(3)]
+        for recipe in recipes:
+            recipe.ingredients.add(ingredient)
+        self.assertTrue(dedup.update_clusters(self.user.id))
+        self.assertFalse(dedup.update_clusters(self.user.id))
+
+        recipes[0].delete()
+        # Izbrisanega recepta ne vrnemo, še preden task skupine izračuna znova
+        res = self.client.get(DUPLICATES_URL)
+        self.assertEqual(res.data, [{
+            'recipes': [{'id': r.id, 'title': r.title} for r in recipes[1:]],
+        }])
+
+        self.assertTrue(dedup.update_clusters(self.user.id))
+        self.assertEqual(
+            RecipeDuplicates.objects.get(user=self.user).clusters, [[r.id for r in recipes[1:]]],
+        )
+        recipes[1].delete()
+        self.assertEqual(self.client.get(DUPLICATES_URL).data, [])
+
+    def test_duplicates_recipe_changed_while_clustering(self):
+        """Test recipes deleted or retitled between the bucket and candidate queries are skipped."""
+        ingredient = Ingredient.objects.create(user=self.user, name='Pasta')
+        recipes = [create_recipe(user=self.user, title='Pasta Carbonara') for _ in range(4)]
+        for recipe in recipes:
+            recipe.ingredients.add(ingredient)
+        dedup.update_signatures(self.user.id)
+        filter_candidates = Recipe.objects.filter
+        changed = []
+
+        def change_then_filter(*args, **kwargs):
+            if 'id__in' in kwargs and not changed:
+                changed.append(True)
+                # Med poizvedbo po bucket-ih in kandidatih en recept izbrišemo, drugemu spremenimo naslov
+                recipes[3].delete()
+                filter_candidates(id=recipes[0].id).update(title='Lasagne')
+            return filter_candidates(*args, **kwargs)
+
+        with patch('recipe.dedup.Recipe.objects.filter', side_effect=change_then_filter):
+            clusters = dedup.clusters(self.user.id)
+
+        self.assertEqual(clusters, [[r.id for r in recipes[1:3]]])
+
+    @patch('recipe.dedup.executor.submit')
+    def test_duplicate_signature_after_commit(self, patched_submit):
+        """Test signatures of new and changed recipes are computed after commit, not in the request."""
+        patched_submit.side_effect = lambda task, *args: task(*args)
+        payload = {
+            'title': 'Pasta Carbonara',
+            'time_minutes': 20,
+            'price': '4.50',
+            'ingredients': [{'name': 'Pasta'}, {'name': 'Eggs'}],
+        }
+        recipes = Recipe.objects.filter(user=self.user)
+
+        # Task zapre povezavo na bazo - v testu teče v isti niti kot test
+        with patch.object(connection, 'close'):
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(RECIPES_URL, payload, format='json')
+                bulk_res = self.client.post(BULK_URL, [payload, payload], format='json')
+                self.assertFalse(recipes.filter(minhash__isnull=False).exists())
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(detail_url(res.data['id']), {'title': 'Carbonara'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(bulk_res.status_code, status.HTTP_201_CREATED)
+        patched_submit.assert_called_with(dedup._task, self.user.id)
+        self.assertEqual(recipes.filter(minhash__isnull=False).count(), 3)
+        self.assertEqual(len(set(tuple(r.lsh_bands) for r in recipes)), 2)
+
+    def test_random_recipes(self):
+        """Test random recipes are distinct recipes of the user."""
+        recipes = [create_recipe(user=self.user, title=f'Recipe {i}') for i in range(20)]
+        create_recipe(user=create_user(email='other@example.com'))
+
+        res = self.client.get(f'{RANDOM_URL}?count=5')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [r['id'] for r in res.data]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertTrue(set(ids) <= {r.id for r in recipes})
+
+    def test_random_recipes_all_or_filtered(self):
+        """Test asking for more random recipes than match returns all of them."""
+        tag = Tag.objects.create(user=self.user, name='Dessert')
+        recipes = [create_recipe(user=self.user, title=f'Recipe {i}') for i in range(3)]
+        recipes[0].tags.add(tag)
+
+        res = self.client.get(f'{RANDOM_URL}?count=10')
+        filtered_res = self.client.get(f'{RANDOM_URL}?count=10&tags={tag.id}')
+
+        self.assertEqual(sorted(r['id'] for r in res.data), [r.id for r in recipes])
+        self.assertEqual([r['id'] for r in filtered_res.data], [recipes[0].id])
+
+    def test_random_recipes_invalid_count(self):
+        """Test the number of random recipes is limited."""
+        res = self.client.get(f'{RANDOM_URL}?count=0')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facets(self):
+        """Test counting the filtered recipes per tag and ingredient."""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        dinner = Tag.objects.create(user=self.user, name='Dinner')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        r1 = create_recipe(user=self.user, title='Soup')
+        r1.tags.add(vegan, dinner)
+        r1.ingredients.add(salt)
+        r2 = create_recipe(user=self.user, title='Salad')
+        r2.tags.add(vegan)
+        r3 = create_recipe(user=self.user, title='Steak')
+        r3.tags.add(dinner)
+        r3.ingredients.add(salt)
+        other = create_recipe(user=create_user(email='other@example.com'))
+        other.tags.add(Tag.objects.create(user=other.user, name='Vegan'))
+
+        res = self.client.get(FACETS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'], [
+            {'id': dinner.id, 'name': 'Dinner', 'count': 2},
+            {'id': vegan.id, 'name': 'Vegan', 'count': 2},
+        ])
+        self.assertEqual(res.data['ingredients'], [{'id': salt.id, 'name': 'Salt', 'count': 2}])
+
+        res = self.client.get(f'{FACETS_URL}?tags={vegan.id}')
+
+        self.assertEqual(res.data['tags'], [
+            {'id': vegan.id, 'name': 'Vegan', 'count': 2},
+            {'id': dinner.id, 'name': 'Dinner', 'count': 1},
+        ])
+        self.assertEqual(res.data['ingredients'], [{'id': salt.id, 'name': 'Salt', 'count': 1}])
+
+    def test_facets_cached(self):
+        """Test facets are served from the cache until the recipes change."""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+        self.client.get(FACETS_URL)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(FACETS_URL)
+        self.assertEqual(res['X-Cache'], 'HIT')
+        self.assertEqual(len(queries), 0)
+
+        create_recipe(user=self.user).tags.add(Tag.objects.get(name='Vegan'))
+        res = self.client.get(FACETS_URL)
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['tags'][0]['count'], 2)
 
     def test_filter_by_ingredients(self):
         """Test filtering recipes by ingredients."""
@@ -551,9 +1347,120 @@ class PrivateRecipeApiTests(TestCase):
         s1 = RecipeSerializer(r1)
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data['results'])
+        self.assertIn(s2.data, res.data['results'])
+        self.assertNotIn(s3.data, res.data['results'])
+
+
+class SimilarRecipesApiTests(TestCase):
+    """Tests for the similar recipes API."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='testpass123')
+        self.client.force_authenticate(self.user)
+
+        # Indeksi se shranijo v začasni direktorij
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.index_dir.cleanup)
+        settings = self.settings(RECIPE_SIMILARITY_DIR=self.index_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.tomato, self.basil, self.pasta, self.rice = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Tomato', 'Basil', 'Pasta', 'Rice')
+        ]
+
+    def _recipe(self, title, tags=(), ingredients=()):
+        recipe = create_recipe(user=self.user, title=title)
+        recipe.tags.add(*tags)
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def _similar(self, recipe, **params):
+        query = '&'.join(f'{name}={value}' for name, value in params.items())
+        res = self.client.get(f'{similar_url(recipe.id)}?{query}')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [(r['title'], round(r['similarity'], 3)) for r in res.data]
+
+    def test_similar_recipes(self):
+        """Test recipes are ranked by the Jaccard similarity of tags and ingredients."""
+        pasta = self._recipe('Pasta', [self.vegan], [self.tomato, self.basil, self.pasta])
+        self._recipe('Bruschetta', [self.vegan], [self.tomato, self.basil])
+        self._recipe('Risotto', [], [self.tomato, self.rice])
+        self._recipe('Plain rice', [], [self.rice])
+        other = create_recipe(user=create_user(email='other@example.com'))
+        other.ingredients.add(self.tomato)
+
+        self.assertEqual(
+            self._similar(pasta), [('Bruschetta', 0.75), ('Risotto', 0.2)],
+        )
+        self.assertEqual(
+            self._similar(pasta, metric='cosine', limit=1), [('Bruschetta', 0.866)],
+        )
+
+    def test_similar_recipes_follow_changes(self):
+        """Test the index picks up changed, new and deleted recipes."""
+        pasta = self._recipe('Pasta', [], [self.tomato, self.pasta])
+        risotto = self._recipe('Risotto', [], [self.tomato, self.rice])
+        salad = self._recipe('Salad', [], [self.basil])
+        self.assertEqual(self._similar(pasta), [('Risotto', 0.333)])
+        self.assertTrue(os.listdir(self.index_dir.name))
+
+        # Z RECIPE_SIMILARITY_MAX_PENDING=0 se indeks ob vsaki spremembi združi in shrani
+        for max_pending in (1000, 0):
+            with self.subTest(max_pending=max_pending), \
+                    self.settings(RECIPE_SIMILARITY_MAX_PENDING=max_pending):
+                salad.ingredients.add(self.tomato, self.pasta)
+                self._recipe('Spaghetti', [], [self.pasta])
+                risotto.delete()
+
+                self.assertEqual(
+                    self._similar(pasta), [('Salad', 0.667), ('Spaghetti', 0.5)],
+                )
+
+                salad.ingredients.remove(self.tomato, self.pasta)
+                Recipe.objects.filter(title='Spaghetti').delete()
+                risotto = self._recipe('Risotto', [], [self.tomato, self.rice])
+
+    def test_similar_recipes_late_commit(self):
+        """Test a recipe committed long after its updated_at is still picked up."""
+        pasta = self._recipe('Pasta', [], [self.tomato, self.pasta])
+        self._recipe('Risotto', [], [self.tomato, self.rice])
+        self.assertEqual(self._similar(pasta), [('Risotto', 0.333)])
+
+        # Transakcija, ki je recept zapisala pred eno uro in se šele zdaj commit-a
+        salad = self._recipe('Salad', [], [self.tomato, self.pasta])
+        Recipe.objects.filter(id=salad.id).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(self._similar(pasta), [('Salad', 1.0), ('Risotto', 0.333)])
+
+    def test_similarity_indexes_bounded_by_bytes(self):
+        """Test a process keeps indexes up to RECIPE_SIMILARITY_MAX_BYTES, least recently used out first."""
+        other_user = create_user(email='other@example.com')
+        pasta = self._recipe('Pasta', [], [self.tomato, self.pasta])
+        create_recipe(user=other_user).ingredients.add(self.tomato)
+
+        with patch.dict(similarity._indexes, clear=True):
+            self._similar(pasta)
+            size = similarity._indexes[self.user.id].nbytes
+            # Prostor samo za en indeks
+            with self.settings(RECIPE_SIMILARITY_MAX_BYTES=size + 1):
+                similarity.get_index(other_user.id)
+                self.assertEqual(list(similarity._indexes), [other_user.id])
+
+            self._similar(pasta)
+            self.assertEqual(list(similarity._indexes), [other_user.id, self.user.id])
+
+    def test_similar_recipe_of_other_user(self):
+        """Test similar recipes of another user's recipe are not found."""
+        other = create_recipe(user=create_user(email='other@example.com'))
+
+        res = self.client.get(similar_url(other.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
 
 # Tests for uploading images
@@ -607,4 +1514,208 @@ class ImageUploadTests(TestCase):
         payload = {"image": "notanimage"} #Poslali bomo tekst namesto slike (da simuliramo napako)
         res = self.client.post(url, payload, format="multipart")
 
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch("recipe.images.generate")
+    def test_upload_image_leaves_derivatives_to_worker(self, patched_generate):
+        """Test the upload only stores the original; the image worker makes derivatives."""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as image_file:
+            Image.new("RGB", (10, 10)).save(image_file, format="JPEG")
+            image_file.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(url, {"image": image_file}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["image_derivatives"], {})
+        self.assertEqual(list(images.pending()), [self.recipe])
+        patched_generate.assert_not_called()
+
+    def test_update_derivatives(self):
+        """Test resized WebP and JPEG derivatives are stored on the recipe."""
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root, RECIPE_IMAGE_SIZES={"thumb": 20, "large": 60}):
+            self.recipe.image.save("photo.png", ContentFile(create_image_bytes((120, 80), "PNG")))
+
+            updated = images.update_derivatives(self.recipe.id, self.user.id, self.recipe.image.name)
+            self.recipe.refresh_from_db()
+            derivatives = self.recipe.image_derivatives
+
+            self.assertTrue(updated)
+            self.assertEqual(set(derivatives), {"thumb", "large"})
+            self.assertEqual((derivatives["thumb"]["width"], derivatives["thumb"]["height"]), (20, 13))
+            self.assertEqual((derivatives["large"]["width"], derivatives["large"]["height"]), (60, 40))
+            with Image.open(os.path.join(media_root, derivatives["large"]["webp"])) as img:
+                self.assertEqual((img.format, img.size), ("WEBP", (60, 40)))
+            with Image.open(os.path.join(media_root, derivatives["thumb"]["jpeg"])) as img:
+                self.assertEqual((img.format, img.size), ("JPEG", (20, 13)))
+
+            res = self.client.get(detail_url(self.recipe.id))
+            self.assertTrue(res.data["image_derivatives"]["thumb"]["webp"].startswith("http://"))
+            self.recipe.image.delete()
+
+    def test_update_derivatives_replaced_image(self):
+        """Test derivatives of a replaced image are not stored."""
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.recipe.image.save("old.jpg", ContentFile(create_image_bytes((10, 10), "JPEG")))
+            old_name = self.recipe.image.name
+            self.recipe.image.save("new.jpg", ContentFile(create_image_bytes((20, 20), "JPEG")))
+
+            updated = images.update_derivatives(self.recipe.id, self.user.id, old_name)
+            self.recipe.refresh_from_db()
+
+            self.assertFalse(updated)
+            self.assertEqual(self.recipe.image_derivatives, {})
+            self.recipe.image.delete()
+
+    @override_settings(RECIPE_IMAGE_MAX_BYTES=100)
+    def test_upload_image_too_large(self):
+        """Test images over the byte budget are rejected."""
+        image_file = SimpleUploadedFile("photo.jpg", create_image_bytes((10, 10), "JPEG"))
+        res = self.client.post(image_upload_url(self.recipe.id), {"image": image_file}, format="multipart")
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data["image"], ["Image is larger than 100 bytes."])
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=99)
+    def test_upload_image_too_many_pixels(self):
+        """Test images over the pixel budget are rejected before decoding."""
+        image_file = SimpleUploadedFile("photo.png", create_image_bytes((10, 10), "PNG"))
+        with patch("PIL.ImageFile.ImageFile.load") as patched_load:
+            res = self.client.post(image_upload_url(self.recipe.id), {"image": image_file}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data["image"], ["Image has more than 99 pixels."])
+        patched_load.assert_not_called()
+
+    def test_upload_image_streams_to_disk(self):
+        """Test the upload endpoint receives images through the streaming handler."""
+        handler_class = uploads.StreamingImageUploadHandler
+        image_file = SimpleUploadedFile("photo.jpg", create_image_bytes((10, 10), "JPEG"))
+        with patch.object(
+            handler_class, "file_complete", autospec=True, side_effect=handler_class.file_complete,
+        ) as patched_complete:
+            res = self.client.post(image_upload_url(self.recipe.id), {"image": image_file}, format="multipart")
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        patched_complete.assert_called_once()
+
+    def test_streaming_upload_handler(self):
+        """Test uploaded chunks are written to disk and hashed."""
+        data = create_image_bytes((10, 10), "JPEG")
+        handler = uploads.StreamingImageUploadHandler()
+        handler.new_file("image", "photo.jpg", "image/jpeg", None)
+        for start in range(0, len(data), 64):
+            handler.receive_data_chunk(data[start:start + 64], start)
+        uploaded_file = handler.file_complete(len(data))
+
+        with open(uploaded_file.temporary_file_path(), "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(uploaded_file.size, len(data))
+        self.assertEqual(uploaded_file.sha256, hashlib.sha256(data).hexdigest())
+        uploaded_file.close()
+
+    @override_settings(RECIPE_IMAGE_MAX_BYTES=100)
+    def test_streaming_upload_handler_over_budget(self):
+        """Test the handler stops storing a file over the byte budget."""
+        data = create_image_bytes((10, 10), "JPEG")
+        handler = uploads.StreamingImageUploadHandler()
+        handler.new_file("image", "photo.jpg", "image/jpeg", None)
+        for start in range(0, len(data), 64):
+            handler.receive_data_chunk(data[start:start + 64], start)
+        uploaded_file = handler.file_complete(len(data))
+
+        self.assertEqual(os.path.getsize(uploaded_file.temporary_file_path()), 0)
+        self.assertEqual(uploaded_file.size, len(data))
+        self.assertIsNone(uploaded_file.sha256)
+        uploaded_file.close()
+
+    @patch("recipe.images.generate")
+    def test_update_derivatives_shared_image(self, patched_generate):
+        """Test derivatives of an image another recipe already uses are reused."""
+        derivatives = {"thumb": {"width": 10, "height": 10, "webp": "a.webp", "jpeg": "a.jpeg"}}
+        create_recipe(user=self.user, image="uploads/recipe/shared.jpg", image_derivatives=derivatives)
+        Recipe.objects.filter(id=self.recipe.id).update(image="uploads/recipe/shared.jpg")
+
+        updated = images.update_derivatives(self.recipe.id, self.user.id, "uploads/recipe/shared.jpg")
+        self.recipe.refresh_from_db()
+
+        self.assertTrue(updated)
+        self.assertEqual(self.recipe.image_derivatives, derivatives)
+        patched_generate.assert_not_called()
+        self.recipe.image = None
+
+
+def media_url(name):
+    """Create and return a protected media URL."""
+    return reverse('media', args=[name])
+
+
+class RecipeMediaApiTests(TestCase):
+    """Tests for the protected media view."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email="user@example.com", password="test123")
+        self.client.force_authenticate(self.user)
+        self.name = "uploads/recipe/ab/cd/abcd" + "0" * 60 + ".jpg"
+        self.recipe = create_recipe(user=self.user, image=self.name)
+
+    def test_auth_required(self):
+        """Test authentication is required to fetch media."""
+        res = APIClient().get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_image_accel_redirect(self):
+        """Test the owner's image is handed to nginx with long cache headers."""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["X-Accel-Redirect"], f"/protected-media/{self.name}")
+        self.assertEqual(res["Content-Type"], "image/jpeg")
+        self.assertEqual(res.content, b"")
+        self.assertEqual(
+            sorted(res["Cache-Control"].split(", ")), ["immutable", "max-age=31536000", "private"],
+        )
+
+    def test_derivative_accel_redirect(self):
+        """Test derivatives of the owner's image are served and revalidated."""
+        name = "uploads/recipe/ab/cd/derivatives/abcd" + "0" * 60 + "/thumb.webp"
+        res = self.client.get(media_url(name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["X-Accel-Redirect"], f"/protected-media/{name}")
+        self.assertEqual(res["Content-Type"], "image/webp")
+        self.assertEqual(sorted(res["Cache-Control"].split(", ")), ["no-cache", "private"])
+
+    def test_other_users_image_not_found(self):
+        """Test images of other users' recipes are not served."""
+        other = create_user(email="other@example.com", password="test123")
+        name = "uploads/recipe/other.jpg"
+        create_recipe(user=other, image=name)
+
+        for path in (name, "uploads/recipe/derivatives/other/thumb.webp", "uploads/recipe/missing.jpg"):
+            res = self.client.get(media_url(path))
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_path_traversal_not_found(self):
+        """Test names that resolve outside the checked file are rejected."""
+        res = self.client.get(media_url("uploads/recipe/derivatives/x/../../../../app/settings.py"))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_URL=None)
+    def test_image_served_without_proxy(self):
+        """Test Django sends the file itself when there is no proxy (DEBUG)."""
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.recipe.image.save("photo.jpg", ContentFile(b"image bytes"))
+            res = self.client.get(media_url(self.recipe.image.name))
+            content = b"".join(res.streaming_content)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn("X-Accel-Redirect", res)
+        self.assertEqual(content, b"image bytes")
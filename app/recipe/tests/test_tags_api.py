@@ -18,6 +18,7 @@ from core.models import (
 from recipe.serializers import TagSerializer
 
 TAGS_URL = reverse("recipe:tag-list")
+AUTOCOMPLETE_URL = reverse("recipe:tag-autocomplete")
 
 def detail_url(tag_id):
     """Create and return a tag detail url."""
@@ -74,7 +75,20 @@ class PrivateTagsApiTests(TestCase):
         serializer = TagSerializer(tags, many=True) #Posredovali bomo več objektov --> zato many=True
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data["results"], serializer.data)
+
+    def test_tags_paginated(self):
+        """Test the tag list is split into pages by name."""
+        for name in ["Vegan", "Dessert", "Breakfast"]:
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_URL, {"page_size": 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag["name"] for tag in res.data["results"]], ["Vegan", "Dessert"])
+
+        res = self.client.get(res.data["next"])
+        self.assertEqual([tag["name"] for tag in res.data["results"]], ["Breakfast"])
+        self.assertIsNone(res.data["next"])
 
     def test_tags_limited_to_user(self):
         """Test list of tags is limited to authenticated user."""
@@ -89,9 +103,9 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data),1) #Preko API-ja mora dobiti samo 1 zapis
-        self.assertEqual(res.data[0]["name"], tag.name) #Ime taga, ki smo ga dobili preko API-ja mora biti enak imenu taga, ki smo ga kreirali in shranili v bazo
-        self.assertEqual(res.data[0]["id"], tag.id)
+        self.assertEqual(len(res.data["results"]),1) #Preko API-ja mora dobiti samo 1 zapis
+        self.assertEqual(res.data["results"][0]["name"], tag.name) #Ime taga, ki smo ga dobili preko API-ja mora biti enak imenu taga, ki smo ga kreirali in shranili v bazo
+        self.assertEqual(res.data["results"][0]["id"], tag.id)
 
     def test_update_tag(self):
         """Test updating a tag."""
@@ -105,6 +119,17 @@ class PrivateTagsApiTests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload["name"])
 
+    def test_update_tag_duplicate_name(self):
+        """Test renaming a tag to the name of another tag fails."""
+        Tag.objects.create(user=self.user, name="Dessert")
+        tag = Tag.objects.create(user=self.user, name="After Dinner")
+
+        res = self.client.patch(detail_url(tag.id), {"name": "Dessert"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, "After Dinner")
+
     def test_delete_tag(self):
         """Test deleting a tag."""
         tag = Tag.objects.create(user=self.user, name="Breakfast")
@@ -133,8 +158,8 @@ class PrivateTagsApiTests(TestCase):
 
         s1 = TagSerializer(tag1)
         s2 = TagSerializer(tag2)
-        self.assertIn(s1.data, res.data)
-        self.assertNotIn(s2.data, res.data)
+        self.assertIn(s1.data, res.data["results"])
+        self.assertNotIn(s2.data, res.data["results"])
 
     def test_filtered_tags_unique(self):
         """Test filtered tags returns a unique list."""
@@ -157,10 +182,58 @@ class PrivateTagsApiTests(TestCase):
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data["results"]), 1)
+
+    def test_tags_ordered_by_popularity(self):
+        """Test ordering tags by the number of recipes using them."""
+        tags = [Tag.objects.create(user=self.user, name=name) for name in ('A', 'B', 'C')]
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                title=f'Recipe {i}', time_minutes=5, price=Decimal('1.00'), user=self.user,
+            )
+            recipe.tags.add(*tags[i:])
+
+        res = self.client.get(TAGS_URL, {'ordering': '-recipe_count'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag['name'] for tag in res.data['results']], ['C', 'B', 'A'])
+
+    def test_tags_invalid_ordering(self):
+        """Test ordering by an unsupported field returns bad request."""
+        res = self.client.get(TAGS_URL, {'ordering': 'user'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_autocomplete_tags(self):
+        """Test autocomplete returns prefix matches first, then fuzzy matches."""
+        Tag.objects.create(user=self.user, name="Vegetarian")
+        Tag.objects.create(user=self.user, name="Vegan")
+        Tag.objects.create(user=self.user, name="Dessert")
+        user2 = create_user(email="user2@example.com")
+        Tag.objects.create(user=user2, name="Vegan")
+
+        res = self.client.get(AUTOCOMPLETE_URL, {"q": "veg"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(tag["name"] for tag in res.data), ["Vegan", "Vegetarian"]
+        )
+
+    def test_autocomplete_tags_misspelled(self):
+        """Test autocomplete tolerates misspellings."""
+        tag = Tag.objects.create(user=self.user, name="Breakfast")
+        Tag.objects.create(user=self.user, name="Dinner")
 
+        res = self.client.get(AUTOCOMPLETE_URL, {"q": "brekfast"})
 
+        self.assertEqual(res.data, [TagSerializer(tag).data])
 
+    def test_autocomplete_tags_limit(self):
+        """Test autocomplete returns at most `limit` results."""
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f"Lunch {i}")
 
+        res = self.client.get(AUTOCOMPLETE_URL, {"q": "lu", "limit": 2})
 
+        self.assertEqual(len(res.data), 2)
 
@@ -0,0 +1,43 @@
+"""
+Streaming upload handling for recipe images.
+
+By default Django keeps uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE in worker
+memory and copies larger ones to disk after the fact. The image upload
+endpoint instead writes every chunk straight to a temporary file and hashes
+it on the way (SHA-256). Memory per upload is one chunk, whatever the file
+size. Files over RECIPE_IMAGE_MAX_BYTES stop being stored; the rest of the
+file is read and discarded so the serializer can reject it with its size.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class StreamingImageUploadHandler(TemporaryFileUploadHandler):
+    """Write uploaded files to disk chunk by chunk and compute their SHA-256.
+
+    The completed file has a `sha256` attribute (None if it was too large).
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.oversized = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.oversized:
+            return None
+        if start + len(raw_data) > settings.RECIPE_IMAGE_MAX_BYTES:
+            # Prevelika datoteka - zapisani del zavržemo, velikost šteje parser naprej
+            self.oversized = True
+            self.file.truncate(0)
+            return None
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.sha256 = None if self.oversized else self.sha256.hexdigest()
+        return uploaded_file
@@ -1,6 +1,40 @@
 """
 Views for the recipes APIs
 """
+import hashlib
+import mimetypes
+import posixpath
+from urllib.parse import quote
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+)
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (
+    BooleanField,
+    Count,
+    Exists,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    IntegerField,
+    Max,
+    OuterRef,
+    Prefetch,
+    Q,
+    Sum,
+    TextField,
+    Value,
+)
+from django.db.utils import IntegrityError, OperationalError
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.db.models.functions import Cast, Concat
 from drf_spectacular.utils import (
     extend_schema_view,
     extend_schema,
@@ -16,13 +50,104 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.views import APIView
 
+from core.lookups import ArrayMissingCount, TrigramWordSimilarity
+from core.storage import is_content_addressed
 from core.models import (
     Recipe,
+    RecipeDuplicates,
     Tag,
     Ingredient,
 )
-from recipe import serializers
+from recipe import cache, dedup, images, sampling, serializers, similarity, uploads
+from recipe.pagination import KeysetPagination
+
+# Konfiguracija za full-text search.
+# Mora biti enaka kot v triggerju (core/migrations/0007_recipe_search_vector.py)
+SEARCH_CONFIG = "english"
+
+# Tag-i in sestavine recepta so vedno urejeni po ID-ju (enako kot v RecipeListSerializer)
+ORDERED_RELATIONS = (
+    Prefetch("tags", queryset=Tag.objects.order_by("id")),
+    Prefetch("ingredients", queryset=Ingredient.objects.order_by("id")),
+)
+
+# Parametri za izbiro polj v odgovoru (glej serializers.select_fields)
+SPARSE_FIELDS_PARAMETERS = [
+    OpenApiParameter(
+        "fields",
+        OpenApiTypes.STR,
+        description="Comma separated list of fields to return (id is always returned).",
+    ),
+    OpenApiParameter(
+        "include",
+        OpenApiTypes.STR,
+        description="Comma separated list of nested relations to embed (tags, ingredients).",
+    ),
+]
+
+# Parametri za filtriranje receptov (seznam in facets)
+# We specify the parameters that can be accepted in the API request
+RECIPE_FILTER_PARAMETERS = [
+    OpenApiParameter(
+        "q",
+        OpenApiTypes.STR,
+        description="Full-text search over title and description (ranked).",
+    ),
+    OpenApiParameter(
+        "tags",
+        OpenApiTypes.STR, # string (ker sprejemamo ID-je ločene z vejico v stringu)
+        description="Comma separated list of IDs to filter.",
+    ),
+    OpenApiParameter(
+        "ingredients",
+        OpenApiTypes.STR, # string
+        description="Comma separated list of ingredient IDs to filter."
+    ),
+    OpenApiParameter(
+        "match",
+        OpenApiTypes.STR, enum=["any", "all"],
+        description="Return recipes with any (default) or all of the given tags/ingredients.",
+    ),
+    OpenApiParameter(
+        "price_min",
+        OpenApiTypes.DECIMAL,
+        description="Minimum price (inclusive).",
+    ),
+    OpenApiParameter(
+        "price_max",
+        OpenApiTypes.DECIMAL,
+        description="Maximum price (inclusive).",
+    ),
+    OpenApiParameter(
+        "time_max",
+        OpenApiTypes.INT,
+        description="Maximum cooking time in minutes (inclusive).",
+    ),
+]
+
+class CachedListMixin:
+    """Serve list responses from the per-user versioned cache."""
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(
+            request, lambda: super(CachedListMixin, self).list(request, *args, **kwargs),
+        )
+
+    def cached(self, request, get_response):
+        """Return the cached response to `request`, or get and cache it."""
+        key = cache.response_key(request)
+        data = cache.get_response(key)
+        if data is not None:
+            return Response(data, headers={"X-Cache": "HIT"})
+
+        response = get_response()
+        cache.set_response(key, response.data)
+        response["X-Cache"] = "MISS"
+        return response
+
 
 # S tem razširimo API dokumentacijo, ki jo sicer avtomatično naredi drf_spectacular
 @extend_schema_view(
@@ -31,22 +156,20 @@ from recipe import serializers
     list=extend_schema(
 
         # Navedemo parametre, ki jih lahko pošljemo GET metodi ("list endpointu"), ko ga kličemo
-        # We specify the parameters that can be accepted in the API request
         parameters=[
+            *RECIPE_FILTER_PARAMETERS,
             OpenApiParameter(
-                "tags",
-                OpenApiTypes.STR, # string (ker sprejemamo ID-je ločene z vejico v stringu)
-                description="Comma separated list of IDs to filter.",
+                "ordering",
+                OpenApiTypes.STR,
+                enum=serializers.RecipeFilterSerializer.ORDERING_CHOICES,
+                description="Sort order (default -id, or by rank when searching).",
             ),
-            OpenApiParameter(
-                "ingredients",
-                OpenApiTypes.STR, # string
-                description="Comma separated list of ingredient IDs to filter."
-            )
+            *SPARSE_FIELDS_PARAMETERS,
         ]
-    )
+    ),
+    retrieve=extend_schema(parameters=SPARSE_FIELDS_PARAMETERS),
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedListMixin, viewsets.ModelViewSet):
     """View for manage recipe APIs."""
 
     """
@@ -71,6 +194,92 @@ class RecipeViewSet(viewsets.ModelViewSet):
     #And you need to be authenticated.
     permission_classes = [IsAuthenticated]
 
+    #Seznam receptov vračamo po straneh (keyset paginacija po "-id")
+    pagination_class = KeysetPagination
+
+    # Query plan za vsako akcijo posebej.
+    # Each action declares which relations it prefetches/joins and which columns it loads,
+    # so the number of queries stays constant no matter how many recipes are returned.
+    # Akcije, ki jih ni v seznamu, dobijo "privzeti" queryset (brez prefetch-a).
+    query_plans = {
+        "list": {
+            # Seznam beremo z values() - tag-e in sestavine naloži RecipeListSerializer
+            # (hitra pot brez model instanc, glej serializers.RecipeListSerializer)
+            "values": True,
+        },
+        "retrieve": {
+            "prefetch_related": ORDERED_RELATIONS,
+        },
+        "update": {
+            "prefetch_related": ORDERED_RELATIONS,
+        },
+        "partial_update": {
+            "prefetch_related": ORDERED_RELATIONS,
+        },
+        "upload_image": {
+            # Za upload slike potrebujemo samo sliko (ostala polja ne naložimo)
+            #OPOMBA: updated_at mora biti naložen, sicer ga save() ne posodobi
+            "only": ("id", "user", "image", "image_derivatives", "updated_at"),
+        },
+        "destroy": {
+            "only": ("id", "user", "image", "updated_at"),
+        },
+        "random_sample": {
+            "values": True,
+        },
+        "similar": {
+            # Potrebujemo samo preverbo, da recept obstaja (podobne preberemo z values())
+            "only": ("id", "user"),
+        },
+    }
+
+    def list(self, request, *args, **kwargs):
+        """List recipes, or 304 if none of the user's recipes changed."""
+        state = Recipe.objects.filter(user=request.user).aggregate(
+            count=Count('id'),
+            updated_at=Max('updated_at'),
+        )
+        etag = self._etag(request, state['count'], state['updated_at'])
+        return self._conditional(
+            request, etag, lambda: super(RecipeViewSet, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a recipe, or 304 if it did not change."""
+        try:
+            updated_at = Recipe.objects.filter(
+                user=request.user, pk=kwargs['pk'],
+            ).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            updated_at = None
+        if updated_at is None:
+            # Recept ne obstaja - za 404 poskrbi standardna logika
+            return super().retrieve(request, *args, **kwargs)
+
+        etag = self._etag(request, updated_at)
+        return self._conditional(
+            request, etag, lambda: super(RecipeViewSet, self).retrieve(request, *args, **kwargs),
+        )
+
+    def _etag(self, request, *state):
+        """Build a strong ETag from the data state and the request variant."""
+        #OPOMBA: URL (filtri, cursor, ...) in format odgovora vplivata na vsebino odgovora
+        parts = (request.user.id, request.get_full_path(), request.accepted_media_type) + state
+        digest = hashlib.sha1(":".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+        return f'"{digest}"'
+
+    def _conditional(self, request, etag, get_response):
+        """Return 304 if the client has `etag`, otherwise the full response."""
+        client_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        # If-None-Match uporablja "weak" primerjavo (W/ ignoriramo)
+        if '*' in client_etags or etag in [tag.replace('W/', '', 1) for tag in client_etags]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        response = get_response()
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
     # parametri za filtriranje (so podani v obliki comma-separated string)
     def _params_to_ints(self, qs):
         """Convert a list to strings to integers"""
@@ -93,22 +302,156 @@ class RecipeViewSet(viewsets.ModelViewSet):
         #Poberemo parametre iz requesta
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
+        match = self.request.query_params.get('match', 'any')
+        if match not in ('any', 'all'):
+            raise ValidationError({'match': 'Must be "any" or "all".'})
 
         # Nastavimo v spremenljivo referenco na queryset - da bomo lahko aplicirali filtre na queryset in potem vrnili rezultat
         # Kot izhodišče vzamemo queryset, ki smo ga zgoraj nastavili in ki vsebuje vse "zapise" - potem pa ga sfiltriramo
         queryset = self.queryset
 
+        #OPOMBA: Filtriramo s semi-join-i (EXISTS / IN) namesto z JOIN-om, tako da se recepti
+        #ne podvajajo in ne potrebujemo DISTINCT čez cele vrstice.
         if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids) # Sintaksa za filtriranje relacijskih podatkov --> dvojni podčrtaj
+            queryset = self._filter_related(
+                queryset, Recipe.tags.through, 'tag_id',
+                self._params_to_ints(tags), match,
+            )
         if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = self._filter_related(
+                queryset, Recipe.ingredients.through, 'ingredient_id',
+                self._params_to_ints(ingredients), match,
+            )
 
-        return queryset.filter(
+        #Filtri po ceni in času priprave ter sortiranje
+        filters = serializers.RecipeFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+        if 'price_min' in params:
+            queryset = queryset.filter(price__gte=params['price_min'])
+        if 'price_max' in params:
+            queryset = queryset.filter(price__lte=params['price_max'])
+        if 'time_max' in params:
+            queryset = queryset.filter(time_minutes__lte=params['time_max'])
+
+        queryset = queryset.filter(
             user=self.request.user
-        ).order_by('-id').distinct()
+        ).order_by('-id')
+
+        if self._search_terms():
+            queryset = self._search(queryset, self._search_terms())
+        if params.get('ordering'):
+            # Keyset paginacija doda "id" kot tie-breaker --> index (user, <stolpec>, id)
+            queryset = queryset.order_by(params['ordering'])
+
+        return self._apply_query_plan(queryset)
+
+    def _search_terms(self):
+        """Return the full-text search terms for the list action."""
+        if self.action not in ('list', 'facets'):
+            return ''
+        return self.request.query_params.get('q', '').strip()
+
+    def _search(self, queryset, terms):
+        """Full-text search ordered by rank, with a highlighted snippet."""
+        query = SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch')
+
+        return queryset.filter(search_vector=query).annotate(
+            # Cast v float8, da se rank iz cursor-ja (paginacija) natančno ujema z vrednostjo v bazi
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+            snippet=SearchHeadline(
+                Concat('title', Value(' '), 'description', output_field=TextField()),
+                query,
+                config=SEARCH_CONFIG,
+                start_sel='<mark>',
+                stop_sel='</mark>',
+                max_words=35,
+                min_words=15,
+            ),
+        ).order_by('-rank', '-id')
+
+    def _filter_related(self, queryset, through, field, ids, match):
+        """Filter recipes related to any/all of the IDs through the M2M table."""
+        rows = through.objects.filter(**{f'{field}__in': ids})
+
+        if match == 'all':
+            # Recept mora imeti VSE podane ID-je: grupiramo po receptu in preštejemo zadetke
+            matching = rows.values('recipe_id').annotate(
+                matched=Count(field),
+            ).filter(matched=len(set(ids))).values('recipe_id')
+            return queryset.filter(id__in=matching)
 
+        return queryset.filter(Exists(rows.filter(recipe_id=OuterRef('pk'))))
+
+    def _apply_query_plan(self, queryset):
+        """Apply the query plan declared for the current action."""
+        plan = self._narrow_query_plan(
+            self.query_plans.get(self.action, {}), queryset,
+        )
+
+        if plan.get("select_related"):
+            queryset = queryset.select_related(*plan["select_related"])
+        if plan.get("prefetch_related"):
+            queryset = queryset.prefetch_related(*plan["prefetch_related"])
+        if plan.get("only"):
+            queryset = queryset.only(*plan["only"])
+        if plan.get("values"):
+            queryset = queryset.values(*self._value_columns(queryset))
+
+        return queryset
+
+    def _ordering_columns(self, queryset):
+        """Return the columns the queryset is ordered by (needed by the cursor)."""
+        return [
+            name.lstrip('-') for name in queryset.query.order_by
+            if isinstance(name, str)
+        ]
+
+    def _value_columns(self, queryset):
+        """Return the values() columns for the serializer fields (without relations)."""
+        serializer_class = self.get_serializer_class()
+        names = self._selected_fields() or serializer_class.Meta.fields
+        return [
+            name for name in dict.fromkeys([*names, *self._ordering_columns(queryset)])
+            if name not in serializer_class.expandable_fields
+        ]
+
+    def _narrow_query_plan(self, plan, queryset):
+        """Load only the columns and relations of the selected fields."""
+        selected = self._selected_fields()
+        if selected is None or plan.get("values"):
+            return plan
+
+        columns = {field.name for field in Recipe._meta.concrete_fields}
+        return dict(
+            plan,
+            prefetch_related=tuple(
+                lookup for lookup in plan.get("prefetch_related", ())
+                if getattr(lookup, "prefetch_to", lookup) in selected
+            ),
+            only=tuple(
+                name for name in dict.fromkeys(
+                    ["id", *selected, *self._ordering_columns(queryset)]
+                )
+                if name in columns
+            ),
+        )
+
+    def _selected_fields(self):
+        """Return the fields selected with ?fields= / ?include=, or None for all."""
+        if self.action not in ('list', 'retrieve'):
+            return None
+        if not hasattr(self, '_selected_fields_cache'):
+            self._selected_fields_cache = serializers.select_fields(
+                self.get_serializer_class(), self.request.query_params,
+            )
+        return self._selected_fields_cache
+
+    def get_serializer_context(self):
+        """Pass the selected fields to the serializer."""
+        context = super().get_serializer_context()
+        context['fields'] = self._selected_fields()
+        return context
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
@@ -125,13 +468,25 @@ class RecipeViewSet(viewsets.ModelViewSet):
         or p#roviding different serializers to different types of users.
         """
 
-        if self.action == 'list':
+        if self.action == 'list' and self._search_terms():
+            return serializers.RecipeSearchSerializer
+        elif self.action == 'list':
             #It expects that we return a reference to the class, not the object of the class.
             #Vrnemo referenco na class --> zato ne smemo uporabiti na koncu (), kar naredi nov class (pokliče konstruktor)
             #DFR bo sam naredil objekt.
             return serializers.RecipeSerializer #Obvezno brez ()
         elif self.action == "upload_image": # A custom action, ki jo definiramo spodaj
             return serializers.RecipeImageSerializer
+        elif self.action in ("bulk", "bulk_update", "bulk_destroy", "random_sample"):
+            return serializers.RecipeSerializer
+        elif self.action == "facets":
+            return serializers.RecipeFacetsSerializer
+        elif self.action == "pantry":
+            return serializers.PantrySerializer
+        elif self.action == "similar":
+            return serializers.RecipeSimilarSerializer
+        elif self.action == "duplicates":
+            return serializers.DuplicateClusterSerializer
 
         return self.serializer_class
 
@@ -146,20 +501,288 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Create a new recipe."""
         serializer.save(user=self.request.user)
+        # Podpis za iskanje podvojenih receptov izračunamo po commit-u, izven request-a
+        dedup.schedule(self.request.user.id)
+
+    def perform_update(self, serializer):
+        """Update a recipe."""
+        serializer.save()
+        # Trigger je podpis izbrisal, če sta se spremenila naslov ali sestavine
+        dedup.schedule(self.request.user.id)
+
+    def perform_destroy(self, instance):
+        """Delete a recipe."""
+        instance.delete()
+        # Recept je morda bil v kateri od shranjenih skupin podvojenih receptov
+        dedup.schedule(self.request.user.id)
 
     #Custom action
     @action(methods=["POST"], detail=True, url_path="upload_image") #detail=True -> indikator, da se akcija nanaša na en zapis tega modela
     def upload_image(self, request, pk=None):
         """Upload an image to recipe."""
         recipe = self.get_object() # Metoda vrne objekt za pk, ki je specificiran v parameteru metode
+        #OPOMBA: Handler moramo nastaviti pred prvim dostopom do request.data (takrat se telo prebere)
+        request.upload_handlers = [uploads.StreamingImageUploadHandler(request)]
         serializer = self.get_serializer(recipe, data=request.data)
 
         if serializer.is_valid():
-            serializer.save() # S tem shranimo sliko v bazo
+            # S tem shranimo sliko v bazo; različice stare slike niso več veljavne
+            # Pomanjšane različice naredi image worker (ločen proces, recipe/images.py)
+            serializer.save(image_derivatives={})
             return Response(serializer.data, status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @extend_schema(parameters=RECIPE_FILTER_PARAMETERS)
+    @action(methods=["GET"], detail=False, url_path="facets")
+    def facets(self, request):
+        """Count the filtered recipes per tag and ingredient."""
+        return self.cached(request, lambda: Response(self._facet_counts()))
+
+    def _facet_counts(self):
+        """Return the facet counts with one grouped UNION ALL query."""
+        recipe_ids = self.get_queryset().order_by().values('id')
+
+        facets = []
+        for kind, field in (('tags', 'tag'), ('ingredients', 'ingredient')):
+            facets.append(
+                getattr(Recipe, kind).through.objects.filter(
+                    recipe_id__in=recipe_ids,
+                ).annotate(
+                    kind=Value(kind, output_field=TextField()),
+                    facet_id=F(f'{field}_id'),
+                    name=F(f'{field}__name'),
+                ).values('kind', 'facet_id', 'name').annotate(count=Count('recipe_id'))
+            )
+        rows = facets[0].union(*facets[1:], all=True).order_by('-count', 'name')
+
+        data = {'tags': [], 'ingredients': []}
+        for row in rows:
+            data[row['kind']].append(
+                {'id': row['facet_id'], 'name': row['name'], 'count': row['count']}
+            )
+        return data
+
+    @extend_schema(
+        request=serializers.PantrySerializer,
+        responses=serializers.RecipePantrySerializer(many=True),
+    )
+    @action(methods=["POST"], detail=False, url_path="pantry")
+    def pantry(self, request):
+        """Find recipes the given ingredients cover, fewest missing first."""
+        params = serializers.PantrySerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        pantry = Value(
+            sorted(set(params.validated_data['ingredients'])),
+            output_field=ArrayField(IntegerField()),
+        )
+        max_missing = params.validated_data['max_missing']
+        #Kandidati imajo vsaj eno sestavino iz shrambe (&& - GIN index na ingredient_ids),
+        #manjkajoče sestavine preštejemo z icount(ingredient_ids - shramba).
+        #OPOMBA: Tudi za max_missing=0 je to hitreje od "<@" (glej benchmark_recipes pantry)
+        queryset = Recipe.objects.filter(
+            user=request.user, ingredient_ids__overlap=pantry,
+        ).annotate(
+            missing=ArrayMissingCount('ingredient_ids', pantry),
+        ).filter(missing__lte=max_missing)
+
+        columns = [
+            name for name in serializers.RecipePantrySerializer.Meta.fields
+            if name not in serializers.RecipePantrySerializer.expandable_fields
+        ]
+        rows = queryset.order_by('missing', '-id').values(*columns)[
+            :params.validated_data['limit']
+        ]
+        serializer = serializers.RecipePantrySerializer(
+            list(rows), many=True, context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
+
+    @extend_schema(
+        parameters=[
+            serializers.RandomSampleSerializer,
+            *[p for p in RECIPE_FILTER_PARAMETERS if p.name != 'q'],
+        ],
+        responses=serializers.RecipeSerializer(many=True),
+    )
+    @action(methods=["GET"], detail=False, url_path="random", url_name="random")
+    def random_sample(self, request):
+        """Return random recipes, optionally filtered like the recipe list."""
+        params = serializers.RandomSampleSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        rows = sampling.sample(
+            self.get_queryset(), params.validated_data['count'], self._filter_estimate(),
+        )
+        serializer = self.get_serializer(rows, many=True)
+        return Response(serializer.data)
+
+    def _filter_estimate(self):
+        """Return an upper bound of recipes matching the tag/ingredient filter, or None."""
+        #OPOMBA: recipe_count (migracija 0012) pove, koliko receptov ima tag/sestavino
+        estimates = []
+        for param, model in (('tags', Tag), ('ingredients', Ingredient)):
+            ids = self.request.query_params.get(param)
+            if ids:
+                estimates.append(model.objects.filter(
+                    user=self.request.user, id__in=self._params_to_ints(ids),
+                ).aggregate(total=Sum('recipe_count'))['total'] or 0)
+        return min(estimates, default=None)
+
+    @extend_schema(
+        parameters=[serializers.SimilarSerializer],
+        responses=serializers.RecipeSimilarSerializer(many=True),
+    )
+    @action(methods=["GET"], detail=True, url_path="similar")
+    def similar(self, request, pk=None):
+        """List recipes with the most similar tags and ingredients."""
+        recipe = self.get_object()
+        params = serializers.SimilarSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        #Podobnost izračuna indeks v pomnilniku (recipe/similarity.py), iz baze
+        #preberemo samo najdene recepte
+        index = similarity.get_index(request.user.id)
+        columns = [
+            name for name in serializers.RecipeSimilarSerializer.Meta.fields
+            if name not in serializers.RecipeSimilarSerializer.expandable_fields
+            and name != 'similarity'
+        ]
+        while True:
+            ids, scores = index.similar(
+                recipe.id, params.validated_data['limit'], params.validated_data['metric'],
+            )
+            rows = {
+                row['id']: row for row in
+                Recipe.objects.filter(user=request.user, id__in=ids.tolist()).values(*columns)
+            }
+            #Recepte, ki jih medtem ni več, odstranimo iz indeksa in poizvedbo ponovimo
+            deleted = set(ids.tolist()) - rows.keys()
+            if not deleted:
+                break
+            index.discard(deleted)
+
+        results = []
+        for recipe_id, score in zip(ids.tolist(), scores.tolist()):
+            rows[recipe_id]['similarity'] = score
+            results.append(rows[recipe_id])
+        serializer = serializers.RecipeSimilarSerializer(
+            results, many=True, context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
+
+    @extend_schema(responses=serializers.DuplicateClusterSerializer(many=True))
+    @action(methods=["GET"], detail=False, url_path="duplicates")
+    def duplicates(self, request):
+        """List groups of near-duplicate recipes (similar title and ingredients)."""
+        #OPOMBA: Skupine izračuna task v ozadju (recipe/dedup.py) - tu vrnemo zadnje shranjene.
+        #Če jih še ni ali so kateri recepti brez podpisa (npr. spremenjeni v admin-u), task
+        #sprožimo in spremembe se pokažejo v enem od naslednjih odgovorov
+        stored = RecipeDuplicates.objects.filter(user=request.user).first()
+        if stored is None or Recipe.objects.filter(user=request.user, minhash__isnull=True).exists():
+            dedup.schedule(request.user.id)
+        clusters = stored.clusters if stored is not None else []
+        titles = dict(
+            Recipe.objects.filter(
+                user=request.user, id__in=[i for cluster in clusters for i in cluster],
+            ).values_list('id', 'title')
+        )
+        serializer = serializers.DuplicateClusterSerializer(
+            [
+                # Izbrisane recepte izpustimo, skupine z manj kot dvema receptoma tudi
+                {'recipes': [{'id': i, 'title': titles[i]} for i in cluster if i in titles]}
+                for cluster in clusters
+                if sum(i in titles for i in cluster) > 1
+            ],
+            many=True,
+        )
+        return Response(serializer.data)
+
+    #Bulk endpoint-i za uvoz: POST (create), PATCH (partial update) in DELETE
+    #na /recipes/bulk/ sprejmejo seznam (največ RECIPE_BULK_MAX_BATCH elementov).
+    #OPOMBA: Batch je atomaren - če kateri od elementov ni veljaven, vrnemo 400 s
+    #seznamom napak (po en element za vsak vhodni element) in ne zapišemo ničesar.
+    @extend_schema(request=serializers.RecipeSerializer(many=True))
+    @action(methods=["POST"], detail=False, url_path="bulk")
+    def bulk(self, request):
+        """Create a batch of recipes."""
+        serializer = self.get_serializer(data=self._bulk_items(), many=True)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.save(user=request.user)
+        dedup.schedule(request.user.id)
+
+        return Response(
+            self._bulk_results([recipe.id for recipe in recipes]),
+            status=status.HTTP_201_CREATED,
+        )
+
+    @extend_schema(request=serializers.RecipeSerializer(many=True))
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        """Partially update a batch of recipes (every item has an "id")."""
+        items = self._bulk_items()
+        ids = self._bulk_ids([item.get("id") if isinstance(item, dict) else None for item in items])
+        recipes = self.get_queryset().in_bulk(ids)
+
+        errors = [{} if pk in recipes else {"id": ["Not found."]} for pk in ids]
+        if any(errors):
+            raise ValidationError(errors)
+
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids], data=items, many=True, partial=True,
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        dedup.schedule(request.user.id)
+
+        return Response(self._bulk_results(ids))
+
+    @extend_schema(request={"application/json": {"type": "array", "items": {"type": "integer"}}})
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        """Delete a batch of recipes by ID."""
+        ids = self._bulk_ids(self._bulk_items())
+        recipes = self.get_queryset().filter(id__in=ids)
+        found = set(recipes.values_list("id", flat=True))
+        recipes.delete()
+        dedup.schedule(request.user.id)
+
+        return Response([{"id": pk, "deleted": pk in found} for pk in ids])
+
+    def _bulk_items(self):
+        """Return the list from the request body, checking the batch size."""
+        items = self.request.data
+        if not isinstance(items, list):
+            raise ValidationError({"non_field_errors": ["Expected a list of items."]})
+        if len(items) > settings.RECIPE_BULK_MAX_BATCH:
+            raise ValidationError({"non_field_errors": [
+                f"At most {settings.RECIPE_BULK_MAX_BATCH} items per request."
+            ]})
+        return items
+
+    def _bulk_ids(self, values):
+        """Validate a list of unique recipe IDs."""
+        errors, seen = [], set()
+        for value in values:
+            if not isinstance(value, int) or isinstance(value, bool):
+                errors.append({"id": ["A valid integer is required."]})
+            elif value in seen:
+                errors.append({"id": ["Duplicate id."]})
+            else:
+                errors.append({})
+                seen.add(value)
+        if any(errors):
+            raise ValidationError(errors)
+        return values
+
+    def _bulk_results(self, ids):
+        """Serialize the recipes in the order of `ids` (one query per relation)."""
+        recipes = Recipe.objects.prefetch_related(*ORDERED_RELATIONS).in_bulk(ids)
+        serializer = serializers.RecipeSerializer(
+            [recipes[pk] for pk in ids], many=True, context=self.get_serializer_context(),
+        )
+        return serializer.data
+
 #Za potrebe dopolnitve swagger dokumentacije (da poveš, da so možni opcijski filtri pri klicu tega "list" (GET) endpointa)
 @extend_schema_view(
     list=extend_schema(
@@ -169,10 +792,17 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 OpenApiTypes.INT, enum=[0, 1], #Omejimo nabor podatkov, ki jih sprejmemo na 0 in 1
                 description = "Filter by items assigned to recipes.",
             ),
+            OpenApiParameter(
+                "ordering",
+                OpenApiTypes.STR,
+                enum=["name", "-name", "recipe_count", "-recipe_count"],
+                description="Sort order (default -name); -recipe_count lists the most used first.",
+            ),
         ]
     )
 )
-class BaseRecipeAttrViewSet(mixins.DestroyModelMixin, #handles DELETE
+class BaseRecipeAttrViewSet(CachedListMixin,
+                            mixins.DestroyModelMixin, #handles DELETE
                             mixins.UpdateModelMixin, #handles PUT and PATCHES
                             mixins.ListModelMixin, #handles GET
                             #RetrieveModelMixin, #handled GET for 1 record/object (details)
@@ -180,6 +810,10 @@ class BaseRecipeAttrViewSet(mixins.DestroyModelMixin, #handles DELETE
     """Base viewset for recipe attributes."""
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    # Dovoljena polja za ?ordering= (z "-" za padajoče), recipe_count = priljubljenost
+    ordering_fields = ("name", "recipe_count")
 
     def get_queryset(self):
         """Filter queryset to authenticated user."""
@@ -187,13 +821,89 @@ class BaseRecipeAttrViewSet(mixins.DestroyModelMixin, #handles DELETE
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0)) # Default=0
         )
+        ordering = self.request.query_params.get('ordering', '-name')
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({'ordering': f'Must be one of: {", ".join(self.ordering_fields)}.'})
+
         queryset = self.queryset # PAZI: lokalna tabela z istim imenom (Pri pythonu s tem ne spremeniš globalne spremenljivke)
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False) # Sintaksa za filtre na relacijskih tabelah
+            #OPOMBA: Števec vzdržuje trigger v bazi - ni JOIN-a na M2M tabelo in ni DISTINCT-a
+            queryset = queryset.filter(recipe_count__gt=0)
 
         return queryset.filter( #POZOR: ni self.queryset, ker je to druga (globalna) spremenljivka. Podatke smo pa pripravili v lokalni spremenljivki.
             user=self.request.user
-        ).order_by('-name').distinct()
+        ).order_by(ordering)
+
+    def perform_update(self, serializer):
+        """Rename, rejecting names the user already has."""
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            # Unikatna omejitev (user, name)
+            raise ValidationError({'name': ['You already have an item with this name.']})
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "q",
+                OpenApiTypes.STR,
+                description="Beginning of (or misspelled) name to complete.",
+            ),
+            OpenApiParameter(
+                "limit",
+                OpenApiTypes.INT,
+                description="Maximum number of results (default 10).",
+            ),
+        ]
+    )
+    @action(methods=["GET"], detail=False, url_path="autocomplete")
+    def autocomplete(self, request):
+        """Return the best matching names for a partial or misspelled query."""
+        terms = request.query_params.get("q", "").strip()
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            raise ValidationError({"limit": "Must be an integer."})
+        limit = max(1, min(limit, settings.AUTOCOMPLETE_MAX_RESULTS))
+
+        if not terms:
+            return Response([])
+
+        queryset = self.get_queryset()
+        if len(terms) < 3:
+            # Prekratko za trigrame - iščemo samo po začetku imena
+            queryset = queryset.filter(name__istartswith=terms)
+        else:
+            # name %> terms --> uporabi GIN (gin_trgm_ops) index
+            queryset = queryset.filter(name__trigram_word_similar=terms)
+
+        # Najprej imena, ki se začnejo z iskanim nizom, nato po podobnosti
+        queryset = queryset.annotate(
+            prefix=ExpressionWrapper(
+                Q(name__istartswith=terms), output_field=BooleanField(),
+            ),
+            similarity=TrigramWordSimilarity(terms, "name"),
+        ).order_by("-prefix", "-similarity", "name")[:limit]
+
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SET LOCAL statement_timeout = %s",
+                        [settings.AUTOCOMPLETE_TIMEOUT_MS],
+                    )
+                    cursor.execute(
+                        "SET LOCAL pg_trgm.word_similarity_threshold = %s",
+                        [settings.AUTOCOMPLETE_SIMILARITY_THRESHOLD],
+                    )
+                matches = list(queryset)
+        except OperationalError:
+            # Presegli smo časovni proračun - autocomplete raje ne vrne ničesar
+            matches = []
+
+        serializer = self.get_serializer(matches, many=True)
+        return Response(serializer.data)
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """Manage tags in the databaase."""
@@ -231,4 +941,49 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
 
     #def get_queryset(self):
     #    """Filter queryset to authenticated user."""
-    #    return self.queryset.filter(user=self.request.user).order_by("-name")
\ No newline at end of file
+    #    return self.queryset.filter(user=self.request.user).order_by("-name")
+
+
+class RecipeMediaView(APIView):
+    """Serve a recipe image (or its derivative) to the owner of the recipe."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses={200: OpenApiTypes.BINARY})
+    def get(self, request, name):
+        """Return the image file."""
+        # Samo normalizirana relativna imena (brez "..") - drugače bi preverili eno, poslali pa drugo datoteko
+        if name != posixpath.normpath(name) or name.startswith(("/", "..")):
+            raise Http404
+        recipes = Recipe.objects.filter(user=request.user)
+        source = images.derivative_source(name)
+        if source is None:
+            recipes = recipes.filter(image=name)
+        else:
+            recipes = recipes.filter(image__startswith=source)
+        # Tuje slike so za uporabnika "neobstoječe" (404, ne 403)
+        if not recipes.exists():
+            raise Http404
+
+        if settings.MEDIA_ACCEL_REDIRECT_URL:
+            #OPOMBA: Telo odgovora pošlje nginx (sendfile, Range, If-None-Match) - uwsgi
+            #worker je prost takoj po preverjanju
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_URL + quote(name)
+        else:
+            storage = Recipe._meta.get_field("image").storage
+            try:
+                response = FileResponse(storage.open(name))
+            except FileNotFoundError:
+                raise Http404
+
+        # "private" - odgovor je odvisen od uporabnika, deljeni cache-i ga ne smejo hraniti
+        if is_content_addressed(name):
+            patch_cache_control(
+                response, private=True, max_age=settings.MEDIA_CACHE_MAX_AGE, immutable=True,
+            )
+        else:
+            # Različice se ob ponovnem generiranju prepišejo - brskalnik jih preveri (ETag)
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
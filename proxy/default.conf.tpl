@@ -17,6 +17,23 @@ server {
         alias /vol/static;
     }
 
+    # Media files (recipe images) live in the same volume, but must not be public.
+    # Clients request /media/... from Django (RecipeMediaView), which checks that the
+    # image belongs to the user and answers with an X-Accel-Redirect header.
+    location /static/media/ {
+        return 404;
+    }
+
+    # The X-Accel-Redirect target. "internal" means only such redirects can reach it.
+    # nginx then sends the file itself (sendfile, Range and If-None-Match requests),
+    # keeping the Cache-Control header set by Django, while the uWSGI worker is already free.
+    location /protected-media/ {
+        internal;
+        alias /vol/static/media/;
+        sendfile on;
+        tcp_nopush on;
+    }
+
     # Then we have another location block for just forward slash.
     # And this basically handles the rest of the requests that aren't met by the above block.
     #